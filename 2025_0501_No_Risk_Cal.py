@@ -17,6 +17,7 @@ from PyQt6.QtGui import QFont
 from PyQt6.QtCore import Qt
 import logging
 import numpy as np
+from contract_cache import load_contract_master
 
 
 class OptionDataManager(QObject):
@@ -47,6 +48,8 @@ class OptionDataManager(QObject):
         # 註冊回調函式
         self.api.quote.set_on_bidask_fop_v1_callback(self.quote_callback)
 
+        self.contract_master = load_contract_master(self.api)
+
 
     def event_callback(self, resp_code: int, event_code: int, info: str, event: str):
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -855,10 +858,7 @@ class OptionTQuoteApp(QWidget):
         snapshot = self.option_manager.api.snapshots([future_contract])[0]
         future_price = snapshot.close # 期貨報價
                                                                                 
-        contracts = self.option_manager.api.Contracts.Options['TX1']
-        contracts_filtered = [contract for contract in contracts]
-
-        strike_prices = sorted(set(contract.strike_price for contract in contracts_filtered))
+        strike_prices = self.option_manager.contract_master.strikes_for_category('TX1')
 
         closest_strike = min(strike_prices, key=lambda x: abs(x - future_price)) # 價平
         
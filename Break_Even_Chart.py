@@ -1,6 +1,6 @@
 import shioaji as sj
 import numpy as np
-from datetime import datetime, timedelta, time
+from datetime import timedelta, time
 import sys
 from PyQt6 import QtWidgets
 from PyQt6.QtCore import Qt
@@ -13,6 +13,8 @@ from PyQt6.QtWidgets import (
 )
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtWidgets  
+from contract_cache import load_contract_master
+from portfolio_analytics import adaptive_price_grid
 
 
 
@@ -25,6 +27,7 @@ class OptionDataManager:
         )
 
         self.option_codes = ['TXO', 'TX1', 'TX2', 'TX4', 'TX5']
+        self.contract_master = load_contract_master(self.api, self.option_codes)
         self.expirations = self.get_option_expirations()
 
         Result = self.api.activate_ca(  
@@ -34,39 +37,8 @@ class OptionDataManager:
         )
 
     def get_option_expirations(self):
-        expirations_dict = {}  
-
-        for code in self.option_codes:
-
-            if hasattr(self.api.Contracts.Options, code):
-                code_contracts = getattr(self.api.Contracts.Options, code)
-
-                code_contracts_sorted = sorted(
-                    list(code_contracts),
-                    key=lambda c: datetime.strptime(c.delivery_date, "%Y/%m/%d")
-                )
-
-                for contract in code_contracts_sorted:
-
-                    if contract.category not in expirations_dict:
-                        expirations_dict[contract.category] = []
-
-                    if contract.delivery_date not in expirations_dict[contract.category]:
-                        expirations_dict[contract.category].append(contract.delivery_date)
-                    else:
-                        continue
-
-
-        # 將字典轉換為 (商品, 日期) 的元組列表
-        expiration_list = []
-        for product, dates in expirations_dict.items():
-            for date in dates:
-                expiration_list.append((product, date))
-
-        # 按照日期排序
-        expiration_list.sort(key=lambda x: x[1])
-
-        return expiration_list
+        # (商品, 日期) 的元組列表，已按照日期排序
+        return self.contract_master.expirations()
 
 
 class OptionAnalyzerApp(QWidget):
@@ -152,14 +124,11 @@ class OptionAnalyzerApp(QWidget):
             option_right = 'P' if 'Put' in strategy_type else 'C'
             
             if hasattr(self.option_manager.api.Contracts.Options, code):
-                code_contracts = getattr(self.option_manager.api.Contracts.Options, code)
-                
                 # 獲取並排序履約價
-                self.sorted_strikes = sorted(
-                    [int(c.strike_price) for c in code_contracts 
-                    if c.delivery_date == delivery_date 
-                    and c.option_right.name[0] == option_right]
-                )
+                self.sorted_strikes = [
+                    int(strike) for strike in self.option_manager.contract_master.strikes_for_category(
+                        code, delivery_date, option_right)
+                ]
                 
                 # 添加履約價到下拉選單
                 self.strikes_combo.addItems([str(strike) for strike in self.sorted_strikes])
@@ -335,7 +304,10 @@ class OptionAnalyzerApp(QWidget):
             premium = 10  # 假设权利金固定为10
             
             # 計算損益
-            x = np.linspace(min(self.sorted_strikes), max(self.sorted_strikes), 500)
+            # 履約價與損益平衡點一定在格點上，目前價格附近較密
+            x = adaptive_price_grid([strike], min(self.sorted_strikes), max(self.sorted_strikes), budget=120,
+                                    center=getattr(self, 'current_price', None),
+                                    breakevens=[strike - premium, strike + premium])
             y_sell_put = np.where(x >= strike, premium, premium - (strike - x))
             y_sell_call = np.where(x <= strike, premium, premium - (x - strike))
             y_buy_call = np.where(x <= strike, -premium, (x - strike) - premium)
@@ -1,292 +1,604 @@
-import sys
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from PyQt6.QtWidgets import QApplication, QWidget
-from PyQt6.QtCore import QTimer
 import shioaji as sj
-import json
+import numpy as np
 import os
+from snapshot_batch import fetch_snapshots, RateLimiter
+from otm_storage import OtmSeriesWriter, OtmColumnArchive
+from collector_schedule import CollectorScheduler, trading_day
+from contract_cache import load_contract_master
+from collector_metrics import StageTimer
 
-class OptionDataManager:
-    def __init__(self):
-        self.api = sj.Shioaji()
+DEFAULT_BASE_PATH = r"C:\Users\user\Desktop\公司帳戶"
 
-        self.api.login(
-            api_key="", 
-            secret_key="", 
-        )
 
-        Result = self.api.activate_ca(  
-            ca_path=r"",
-            ca_passwd="",
-            person_id="",
-        )
+def width_label(width):
+    return f"價外{width}檔" if width else "價外整條鏈"
 
-        self.option_codes = ['TXO', 'TX1', 'TX2', 'TX4', 'TX5']
-        self.monthly_code = self.get_monthly_option_code()
+class ChainSlicer:
+    """單一 (商品代碼, 交割月份) 的履約價索引，建立一次後每次取價外檔位只需二分搜尋"""
 
-    def get_weekly_option_codes(self):
-        all_contracts = dir(self.api.Contracts.Options)
-        weekly_codes = [code for code in all_contracts if code.startswith("TX") and not code.startswith("TXO")]
+    def __init__(self, code, delivery_month, contracts):
+        self.code = code
+        self.delivery_month = delivery_month
 
-        if 'TXO' in all_contracts:
-            weekly_codes.append('TX3')  # 視為第三週選擇權
+        calls = {}
+        puts = {}
+        for contract in contracts:
+            if contract.symbol.endswith('C'):
+                calls[contract.strike_price] = contract
+            else:
+                puts[contract.strike_price] = contract
 
-        return sorted(weekly_codes)
-    
-    def get_monthly_option_code(self):
-        current_date = datetime.now()
-        current_month_code = f"TXO{current_date.strftime('%Y%m')}"
-        return current_month_code
+        strike_prices = sorted(set(calls) | set(puts))
+        self.strikes = np.array(strike_prices, dtype=float)
+        self.call_contracts = [calls.get(strike) for strike in strike_prices]
+        self.put_contracts = [puts.get(strike) for strike in strike_prices]
 
-    def get_monthly_snapshots(self):
-        contracts = self.api.Contracts.Options.TXO
+    def atm_position(self, index_price):
+        # 第一個 >= 指數的履約價位置，等同把指數插入排序後的位置
+        return int(np.searchsorted(self.strikes, index_price, side='left'))
 
-        contracts_filtered = [contract for contract in contracts]
+    def window(self, index_price, width=25):
+        """回傳指數上下 width 檔的 (價外 put 合約, 價外 call 合約)，width=None 時為整條鏈"""
+        index_position = self.atm_position(index_price)
 
-        delivery_months = sorted(set(contract.delivery_month for contract in contracts_filtered))
-        delivery_month=delivery_months[0]
+        if width is None:
+            return self.put_contracts[:index_position], self.call_contracts[index_position:]
 
-        if not contracts_filtered:
-            return [], 0.0
+        lower_bound = max(index_position - width, 0)
+        upper_bound = min(index_position + width, len(self.strikes))
 
-        index_contract = self.api.Contracts.Futures.TXF.TXFR1 # 找台指期的指數
-        index_snapshot = self.api.snapshots([index_contract])[0]
-        current_index_price = index_snapshot.close
+        return self.put_contracts[lower_bound:index_position], self.call_contracts[index_position:upper_bound]
 
-        strike_prices = sorted(set(contract.strike_price for contract in contracts_filtered))
 
-        if current_index_price not in strike_prices:
-            strike_prices.append(current_index_price)
-            strike_prices.sort()
-            index_position = strike_prices.index(current_index_price)  
-            strike_prices.remove(current_index_price) 
-        else:
-            index_position = strike_prices.index(current_index_price) 
+def snapshots_to_arrays(snapshots):
+    """[(合約, [快照])] 轉成 (履約價, 買價, 賣價, 成交量) 陣列"""
+    strikes = np.array([contract.strike_price for contract, _ in snapshots], dtype=float)
+    bids = np.array([snap[0].buy_price for _, snap in snapshots], dtype=float)
+    asks = np.array([snap[0].sell_price for _, snap in snapshots], dtype=float)
+    volumes = np.array([snap[0].total_volume for _, snap in snapshots], dtype=float)
+    return strikes, bids, asks, volumes
 
-        lower_bound = max(index_position - 25, 0)
-        upper_bound = min(index_position + 25, len(strike_prices))
 
-        put_filtered_strikes = strike_prices[lower_bound:index_position]
-        call_filtered_strikes = strike_prices[index_position:upper_bound]
+def _ratio(numerator, denominator):
+    return float(numerator / denominator) if denominator else None
 
-        filtered_put_contracts = [self.api.Contracts.Options['TXO'].get(f"{'TXO'}{delivery_month}{int(strike)}P") for strike in put_filtered_strikes]
-        filtered_call_contracts = [self.api.Contracts.Options['TXO'].get(f"{'TXO'}{delivery_month}{int(strike)}C") for strike in call_filtered_strikes]
 
-        call_snapshots = []
-        put_snapshots = []
+def compute_chain_metrics(strikes, bids, asks, volumes, is_call, index_price):
+    """以陣列一次算出價外鏈的各項指標"""
+    is_put = ~is_call
+    mids = (bids + asks) / 2
+    spreads = asks - bids
+    moneyness = np.log(strikes / index_price)
 
-        for put_contract, call_contract in zip(filtered_put_contracts, filtered_call_contracts):
-            try:
-                # 取得 put 和 call 的快照
-                snapshot_put = self.api.snapshots([put_contract]) if put_contract else None
-                snapshot_call = self.api.snapshots([call_contract]) if call_contract else None
+    # 相對價差越大的報價打越多折扣
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative_spreads = np.where(mids > 0, spreads / mids, 1.0)
+    spread_adjusted = mids * np.clip(1 - relative_spreads, 0, 1)
 
-                if snapshot_call and all(snap.close is not None for snap in snapshot_call):
-                    call_snapshots.append((call_contract, snapshot_call))
-                else:
-                    print(f"獲取合約 {call_contract} 的快照失敗")
+    put_otm_sum = float(mids[is_put].sum())
+    call_otm_sum = float(mids[is_call].sum())
+    put_volume = float(volumes[is_put].sum())
+    call_volume = float(volumes[is_call].sum())
 
-                if snapshot_put and all(snap.close is not None for snap in snapshot_put):
-                    put_snapshots.append((put_contract, snapshot_put))
-                else:
-                    print(f"獲取合約 {put_contract} 的快照失敗")
+    # 權利金對 log-moneyness 的斜率：正值代表 call 側較貴，負值代表 put 側較貴
+    skew_slope = float(np.polyfit(moneyness, mids, 1)[0]) if len(strikes) >= 2 else None
 
-            except Exception as e:
-                print(f"獲取合約 {call_contract} 或 {put_contract} 的快照時出錯: {e}")
+    # 以離價平距離加權，越外側的權利金權重越大
+    wing_weights = np.abs(moneyness)
 
-        return call_snapshots, put_snapshots
-    
+    return {
+        "put_otm_sum": put_otm_sum,
+        "call_otm_sum": call_otm_sum,
+        "otm_sum": put_otm_sum + call_otm_sum,
+        "put_call_ratio": _ratio(put_otm_sum, call_otm_sum),
+        "put_volume": put_volume,
+        "call_volume": call_volume,
+        "volume_put_call_ratio": _ratio(put_volume, call_volume),
+        "skew_slope": skew_slope,
+        "wing_weighted_premium": _ratio((mids * wing_weights).sum(), wing_weights.sum()),
+        "put_spread_adjusted_sum": float(spread_adjusted[is_put].sum()),
+        "call_spread_adjusted_sum": float(spread_adjusted[is_call].sum()),
+        "mean_relative_spread": float(relative_spreads.mean()) if len(strikes) else None,
+    }
 
 
-    def get_filtered_snapshots(self, code):
-        current_date = datetime.now()
-        year_month = current_date.strftime("%Y%m")
+class OptionDataManager:
+    def __init__(self, base_path=DEFAULT_BASE_PATH):
+        self.base_path = base_path
+        self.timer = StageTimer(os.path.join(self.base_path, "otm_collector.prom"))
 
-        if code == 'TXO':
-            return self.get_monthly_snapshots()
+        self.api = sj.Shioaji()
 
-        contracts = self.api.Contracts.Options[code]
+        with self.timer.stage("login"):
+            self.api.login(
+                api_key="", 
+                secret_key="", 
+            )
 
-        contracts_filtered = [contract for contract in contracts]
+        with self.timer.stage("activate_ca"):
+            Result = self.api.activate_ca(  
+                ca_path=r"",
+                ca_passwd="",
+                person_id="",
+            )
 
-        delivery_month=contracts_filtered[0].delivery_month
+        self.option_codes = ['TXO', 'TX1', 'TX2', 'TX4', 'TX5']
+        self.otm_writers = {}      # 輸出目標 -> OtmSeriesWriter
+        self.writers_lock = threading.Lock()
+        self.snapshot_limiter = RateLimiter()
+        self.timestamp_format = "%Y-%m-%d %H:%M"   # 秒級排程時改為含秒
+        self.refresh_contracts(download=False)  # 登入時已下載過合約
+
+    def refresh_contracts(self, download=True):
+        """重新下載合約、載入當個交易日的合約主檔並清空鏈索引，跨過到期後不會再收集已下市的序列"""
+        day = trading_day(datetime.now())
+        with self.timer.stage("contracts"):
+            if download:
+                self.api.fetch_contracts(contract_download=True)
+            self.contract_master = load_contract_master(self.api, self.option_codes, day=day)
+        self.chain_slicers = {}     # (商品代碼, 交割月份) -> ChainSlicer
+        self.delivery_months = {}   # 商品代碼 -> 已排序的交割月份
+        self.monthly_code = self.get_monthly_option_code()
+        self.contracts_day = day
 
-        if not contracts_filtered:
-            return [], 0.0
+    def ensure_current_contracts(self):
+        # 每個交易日第一輪 (含夜盤開盤) 先換成新的合約
+        if trading_day(datetime.now()) != self.contracts_day:
+            print("交易日變更，重新載入合約")
+            self.refresh_contracts()
 
-        index_contract = self.api.Contracts.Futures.TXF.TXFR1 # 找台指期的指數
-        index_snapshot = self.api.snapshots([index_contract])[0]
-        current_index_price = index_snapshot.close
+    def get_weekly_option_codes(self):
+        all_contracts = dir(self.api.Contracts.Options)
+        weekly_codes = [code for code in all_contracts if code.startswith("TX") and not code.startswith("TXO")]
 
-        strike_prices = sorted(set(contract.strike_price for contract in contracts_filtered))
+        if 'TXO' in all_contracts:
+            weekly_codes.append('TX3')  # 視為第三週選擇權
+
+        return sorted(weekly_codes)
+    
+    def get_monthly_option_code(self):
+        current_date = datetime.now()
+        current_month_code = f"TXO{current_date.strftime('%Y%m')}"
+        return current_month_code
 
-        if current_index_price not in strike_prices:
-            strike_prices.append(current_index_price)
-            strike_prices.sort()
-            index_position = strike_prices.index(current_index_price)  
-            strike_prices.remove(current_index_price) 
-        else:
-            index_position = strike_prices.index(current_index_price) 
+    def get_chain_slicer(self, code, delivery_month=None):
+        """取得 (商品代碼, 交割月份) 的 ChainSlicer，第一次使用時才走訪合約建立"""
+        if code not in self.delivery_months:
+            with self.timer.stage("contracts"):
+                contracts = self.api.Contracts.Options[code]
 
-        lower_bound = max(index_position - 25, 0)
-        upper_bound = min(index_position + 25, len(strike_prices))
+                grouped = {}
+                for contract in contracts:
+                    grouped.setdefault(contract.delivery_month, []).append(contract)
 
-        put_filtered_strikes = strike_prices[lower_bound:index_position]
-        call_filtered_strikes = strike_prices[index_position:upper_bound]
+                for month, month_contracts in grouped.items():
+                    self.chain_slicers[(code, month)] = ChainSlicer(code, month, month_contracts)
+                self.delivery_months[code] = sorted(grouped)
 
-        filtered_put_contracts = [self.api.Contracts.Options[code].get(f"{code}{delivery_month}{int(strike)}P") for strike in put_filtered_strikes]
-        filtered_call_contracts = [self.api.Contracts.Options[code].get(f"{code}{delivery_month}{int(strike)}C") for strike in call_filtered_strikes]
+        if not self.delivery_months[code]:
+            return None
 
-        call_snapshots = []
-        put_snapshots = []
+        if delivery_month is None:
+            delivery_month = self.delivery_months[code][0]  # 最近月份
 
-        for put_contract, call_contract in zip(filtered_put_contracts, filtered_call_contracts):
-            try:
-                # 取得 put 和 call 的快照
-                snapshot_put = self.api.snapshots([put_contract]) if put_contract else None
-                snapshot_call = self.api.snapshots([call_contract]) if call_contract else None
+        return self.chain_slicers.get((code, delivery_month))
 
-                if snapshot_call and all(snap.close is not None for snap in snapshot_call):
-                    call_snapshots.append((call_contract, snapshot_call))
-                else:
-                    print(f"獲取合約 {call_contract} 的快照失敗")
+    def get_index_price(self):
+        index_contract = self.api.Contracts.Futures.TXF.TXFR1 # 找台指期的指數
+        self.snapshot_limiter.acquire()
+        with self.timer.stage("index_snapshot"):
+            index_snapshot = self.api.snapshots([index_contract])[0]
+        return index_snapshot.close
 
-                if snapshot_put and all(snap.close is not None for snap in snapshot_put):
-                    put_snapshots.append((put_contract, snapshot_put))
-                else:
-                    print(f"獲取合約 {put_contract} 的快照失敗")
+    def get_chain_snapshots(self, code, delivery_month=None, width=25, index_price=None):
+        slicer = self.get_chain_slicer(code, delivery_month)
 
-            except Exception as e:
-                print(f"獲取合約 {call_contract} 或 {put_contract} 的快照時出錯: {e}")
+        if slicer is None:
+            return [], []
 
-        return call_snapshots, put_snapshots
-    
+        current_index_price = index_price if index_price is not None else self.get_index_price()
 
-    def get_latest_contract(self):
-        expirations_dict = {}  
+        filtered_put_contracts, filtered_call_contracts = slicer.window(current_index_price, width)
 
-        for code in self.option_codes:
+        # 價外合約一次批次取得快照
+        with self.timer.stage("chain_snapshots"):
+            snapshots = fetch_snapshots(self.api, filtered_put_contracts + filtered_call_contracts,
+                                        rate_limiter=self.snapshot_limiter)
 
-            if hasattr(self.api.Contracts.Options, code):
-                code_contracts = getattr(self.api.Contracts.Options, code)
+        # put 與 call 各自整理，整條鏈時兩邊檔數不一定相同
+        put_snapshots = self.valid_snapshots(filtered_put_contracts, snapshots)
+        call_snapshots = self.valid_snapshots(filtered_call_contracts, snapshots)
 
-                code_contracts_sorted = sorted(
-                    list(code_contracts),
-                    key=lambda c: datetime.strptime(c.delivery_date, "%Y/%m/%d")
-                )
+        return call_snapshots, put_snapshots
 
-                for contract in code_contracts_sorted:
+    @staticmethod
+    def valid_snapshots(contracts, snapshots):
+        """[(合約, [快照])]，略過沒有快照或沒有收盤價的合約"""
+        result = []
+        for contract in contracts:
+            snapshot = snapshots.get(contract.code) if contract else None
+            if snapshot is not None and snapshot.close is not None:
+                result.append((contract, [snapshot]))
+            else:
+                print(f"獲取合約 {contract} 的快照失敗")
+        return result
 
-                    if contract.category not in expirations_dict:
-                        expirations_dict[contract.category] = []
+    def get_monthly_snapshots(self):
+        return self.get_chain_snapshots('TXO')
 
-                    if contract.delivery_date not in expirations_dict[contract.category]:
-                        expirations_dict[contract.category].append(contract.delivery_date)
-                    else:
-                        continue
+    def get_filtered_snapshots(self, code):
+        return self.get_chain_snapshots(code)
+
+    def start_streaming(self, width=25, record_interval=1.0):
+        """訂閱最近到期價外上下 width 檔的 BidAsk，逐筆更新價外總和。
+        報價回呼只更新總和並記下新的價平位置；移動視窗與寫檔都在背景執行緒，不會卡住報價"""
+        self.stream_target = self.get_latest_contract()[0][0]
+        self.stream_slicer = self.get_chain_slicer(self.stream_target)
+        self.stream_width = width
+        self.stream_lock = threading.Lock()
+        self.stream_contracts = {}  # 合約代碼 -> 合約
+        self.stream_rights = {}     # 合約代碼 -> 'P' / 'C'
+        self.stream_mids = {}       # 合約代碼 -> 目前中價
+        self.stream_quotes = {}     # 合約代碼 -> (買價, 賣價)，寫檔用
+        self.stream_position = None
+        self.stream_version = 0     # 總和每變動一次加一，寫檔執行緒據此判斷有無新資料
+        self.put_otm_sum = 0.0
+        self.call_otm_sum = 0.0
+        self.otm_sum = 0.0
+
+        self.pending_index_price = None
+        self.recenter_event = threading.Event()
+        self.stream_stop = threading.Event()
 
-        expirations = []
-        nearest_category = None
-        nearest_date = None
+        index_contract = self.api.Contracts.Futures.TXF.TXFR1 # 找台指期的指數
+        self.stream_index_contract = index_contract
+        self.stream_index_code = getattr(index_contract, "target_code", None) or index_contract.code
+
+        self.api.quote.set_on_bidask_fop_v1_callback(self.on_stream_bidask)
+        self.recenter_stream(self.get_index_price())
+
+        self.stream_threads = [
+            threading.Thread(target=self.recenter_loop, daemon=True),
+            threading.Thread(target=self.record_loop, args=(record_interval,), daemon=True),
+        ]
+        for thread in self.stream_threads:
+            thread.start()
+
+        self.subscribe_bidask(index_contract)
+
+    def stop_streaming(self):
+        self.unsubscribe_bidask(self.stream_index_contract)
+        self.stream_stop.set()
+        self.recenter_event.set()
+        for thread in self.stream_threads:
+            thread.join()
+
+        with self.stream_lock:
+            contracts = list(self.stream_contracts.values())
+            self.stream_contracts.clear()
+            self.stream_rights.clear()
+            self.stream_mids.clear()
+            self.stream_quotes.clear()
+        for contract in contracts:
+            self.unsubscribe_bidask(contract)
+
+    def subscribe_bidask(self, contract):
+        self.api.quote.subscribe(contract, quote_type=sj.constant.QuoteType.BidAsk, version=sj.constant.QuoteVersion.v1)
+
+    def unsubscribe_bidask(self, contract):
+        self.api.quote.unsubscribe(contract, quote_type=sj.constant.QuoteType.BidAsk, version=sj.constant.QuoteVersion.v1)
+
+    def on_stream_bidask(self, exchange, bidask):
+        bid = float(bidask.bid_price[0])
+        ask = float(bidask.ask_price[0])
+        mid = (bid + ask) / 2
+
+        if bidask.code == self.stream_index_code:
+            # 只記下最新的指數，實際換視窗交給 recenter_loop
+            if self.stream_slicer.atm_position(mid) != self.stream_position:
+                self.pending_index_price = mid
+                self.recenter_event.set()
+            return
+
+        with self.stream_lock:
+            right = self.stream_rights.get(bidask.code)
+            if right is None:
+                return  # 已退訂合約的殘留報價
+
+            # 只調整這一檔的貢獻
+            delta = mid - self.stream_mids[bidask.code]
+            self.stream_mids[bidask.code] = mid
+            self.stream_quotes[bidask.code] = (bid, ask)
+            if right == 'P':
+                self.put_otm_sum += delta
+            else:
+                self.call_otm_sum += delta
+            self.otm_sum += delta
+            self.stream_version += 1
+
+    def recenter_loop(self):
+        while True:
+            self.recenter_event.wait()
+            self.recenter_event.clear()
+            if self.stream_stop.is_set():
+                return
+            try:
+                self.recenter_stream(self.pending_index_price)
+            except Exception as e:
+                print(f"移動訂閱視窗時出錯: {e}")
+
+    def recenter_stream(self, index_price):
+        """指數跨過履約價時移動視窗，只退訂/訂閱進出視窗的合約。
+        只在啟動時與 recenter_loop 中呼叫；快照與訂閱都在 stream_lock 之外進行"""
+        position = self.stream_slicer.atm_position(index_price)
+        if position == self.stream_position:
+            return
+
+        put_contracts, call_contracts = self.stream_slicer.window(index_price, self.stream_width)
+        wanted = {contract.code: (contract, 'P') for contract in put_contracts if contract}
+        wanted.update({contract.code: (contract, 'C') for contract in call_contracts if contract})
+
+        with self.stream_lock:
+            removed = [self.stream_contracts.pop(code) for code in list(self.stream_contracts) if code not in wanted]
+            for contract in removed:
+                del self.stream_rights[contract.code]
+                del self.stream_mids[contract.code]
+                del self.stream_quotes[contract.code]
+            added = [contract for code, (contract, _) in wanted.items() if code not in self.stream_contracts]
+
+        for contract in removed:
+            self.unsubscribe_bidask(contract)
+
+        snapshots = fetch_snapshots(self.api, added, rate_limiter=self.snapshot_limiter)
+
+        with self.stream_lock:
+            for contract in added:
+                snapshot = snapshots.get(contract.code)
+                self.stream_contracts[contract.code] = contract
+                self.stream_rights[contract.code] = wanted[contract.code][1]
+                bid, ask = (snapshot.buy_price, snapshot.sell_price) if snapshot else (0.0, 0.0)
+                self.stream_quotes[contract.code] = (bid, ask)
+                self.stream_mids[contract.code] = (bid + ask) / 2
+
+            # 視窗變動時重新加總一次，順便消除逐筆累加的浮點誤差
+            self.put_otm_sum = sum(mid for code, mid in self.stream_mids.items() if self.stream_rights[code] == 'P')
+            self.call_otm_sum = sum(mid for code, mid in self.stream_mids.items() if self.stream_rights[code] == 'C')
+            self.otm_sum = self.put_otm_sum + self.call_otm_sum
+            self.stream_position = position
+            self.stream_version += 1
+
+        # 先登記再訂閱，第一筆報價進來時已找得到這檔合約
+        for contract in added:
+            self.subscribe_bidask(contract)
+
+    def record_loop(self, interval):
+        """每 interval 秒檢查一次，總和有變動時寫入 JSON Lines 與欄位式資料庫 (秒級序列)"""
+        recorded_version = None
+        while not self.stream_stop.wait(interval):
+            with self.stream_lock:
+                if self.stream_version == recorded_version:
+                    continue
+                recorded_version = self.stream_version
+                codes = list(self.stream_mids)
+                strikes = np.array([self.stream_contracts[code].strike_price for code in codes], dtype=float)
+                is_call = np.array([self.stream_rights[code] == 'C' for code in codes], dtype=bool)
+                quotes = np.array([self.stream_quotes[code] for code in codes], dtype=float).reshape(-1, 2)
+                put_otm_sum, call_otm_sum, otm_sum = self.put_otm_sum, self.call_otm_sum, self.otm_sum
 
-        for category, dates in expirations_dict.items():
-            first_expiration = datetime.strptime(dates[0], '%Y/%m/%d')
-            if nearest_date is None or first_expiration < nearest_date:
-                nearest_date = first_expiration
-                print(nearest_date)
-                nearest_category = category
+            try:
+                self.write_record(self.stream_target, datetime.now(), "%Y-%m-%d %H:%M:%S", strikes, is_call,
+                                  quotes[:, 0], quotes[:, 1], put_otm_sum, call_otm_sum, otm_sum)
+            except OSError as e:
+                print(f"寫入串流資料失敗: {e}")
+
+    def check_stream_rollover(self):
+        # 換交易日時換成新的最近到期並重新訂閱
+        if trading_day(datetime.now()) != self.contracts_day:
+            width = self.stream_width
+            self.stop_streaming()
+            self.refresh_contracts()
+            self.start_streaming(width)
+
+    def print_stream_sums(self):
+        self.check_stream_rollover()
+        with self.stream_lock:
+            put_otm_sum, call_otm_sum, otm_sum = self.put_otm_sum, self.call_otm_sum, self.otm_sum
+
+        label = width_label(self.stream_width)
+        print(f"put的{label}總和:{put_otm_sum}")
+        print(f"call的{label}總和:{call_otm_sum}")
+        print(f"{label}上下總和:{otm_sum}")
+    
 
-        expirations.append((nearest_category, nearest_date.strftime("%Y/%m/%d")))
+    def get_latest_contract(self):
+        nearest = self.contract_master.nearest_expiration()
+        if nearest is None:
+            raise RuntimeError("合約主檔沒有任何到期月份")
+        expirations = [nearest]
         print(expirations)
 
         return expirations
 
-    def get_contract_by_tv_ratio(self):
-
-        sorted_expirations = self.get_latest_contract()
-        target = sorted_expirations[0][0]
-        call_snapshots, put_snapshots = self.get_filtered_snapshots(target)
-
-        otm_dic = {}
-
-        call_otm_sum = 0
-        put_otm_sum = 0
-        otm_sum = 0
-
-        for put_snap, call_snap in zip(put_snapshots, call_snapshots):
-
-            put_strike = put_snap[0].strike_price
-            put_snap_list = put_snap[1]
-            put_buy_price = put_snap_list[0].buy_price if put_snap else 0
-            put_sell_price = put_snap_list[0].sell_price if put_snap else 0
-            put_mean_price = (put_buy_price+put_sell_price)/2
-            otm_dic[put_strike] = put_mean_price
-            put_otm_sum += put_mean_price
-
-            call_strike = call_snap[0].strike_price
-            call_snap_list = call_snap[1]
-            call_buy_price = call_snap_list[0].buy_price if call_snap_list else 0
-            call_sell_price = call_snap_list[0].sell_price if call_snap_list else 0
-            call_mean_price = (call_buy_price+call_sell_price)/2
-            otm_dic[call_strike] = call_mean_price
-            call_otm_sum += call_mean_price
-
-        otm_sum = put_otm_sum + call_otm_sum
-
-        print(f"put的價外25檔總和:{put_otm_sum}")
-        print(f"call的價外25檔總和:{call_otm_sum}")
-        print(f"價外上下25檔總和:{otm_sum}")
-
-        otm_dic = dict(sorted(otm_dic.items()))
+    def get_live_expirations(self):
+        """所有商品代碼目前掛牌的 (商品代碼, 交割月份, 輸出名稱)"""
+        expirations = []
+        for code in self.option_codes:
+            if not hasattr(self.api.Contracts.Options, code):
+                continue
+            self.get_chain_slicer(code)  # 先在主執行緒建好 ChainSlicer
+            for i, month in enumerate(self.delivery_months[code]):
+                # 最近月份沿用原本以商品代碼命名的資料夾
+                expirations.append((code, month, code if i == 0 else f"{code}{month}"))
+        return expirations
 
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-        today = datetime.now().strftime("%Y-%m-%d")
-        date = datetime.now().strftime("%Y-%m")
-        base_path = r"C:\Users\user\Desktop\公司帳戶"
+    def get_otm_writer(self, target):
+        with self.writers_lock:
+            if target not in self.otm_writers:
+                self.otm_writers[target] = OtmSeriesWriter()
+            return self.otm_writers[target]
+
+    def close_writers(self):
+        with self.writers_lock:
+            for writer in self.otm_writers.values():
+                writer.close()
+            self.otm_writers.clear()
+
+    def get_contract_by_tv_ratio(self, width=25):
+        target = ""
+        failed = True
+        try:
+            self.ensure_current_contracts()
+            sorted_expirations = self.get_latest_contract()
+            target = sorted_expirations[0][0]
+            with self.timer.stage("run"):
+                self.collect_otm(target, width=width)
+            failed = False
+        finally:
+            # 出錯時也要輸出摘要並清空本輪累計，否則會混進下一輪
+            self.timer.end_run(target, failed=failed)
+
+    def collect_all_expirations(self, max_workers=4, width=25):
+        """同一輪內並行收集所有到期的價外資料，各到期分別輸出"""
+        failed = True
+        try:
+            self.ensure_current_contracts()
+            with self.timer.stage("run"):
+                expirations = self.get_live_expirations()
+                index_price = self.get_index_price()
+
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {
+                        executor.submit(self.collect_otm, code, month, label, index_price, width): label
+                        for code, month, label in expirations
+                    }
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            print(f"收集 {futures[future]} 時出錯: {e}")
+            failed = False
+        finally:
+            self.timer.end_run("all", failed=failed)
+
+    def collect_otm(self, code, delivery_month=None, label=None, index_price=None, width=25):
+        target = label or code
+        if index_price is None:
+            index_price = self.get_index_price()
+        call_snapshots, put_snapshots = self.get_chain_snapshots(code, delivery_month, width, index_price)
+
+        with self.timer.stage("aggregation"):
+            if width is not None:
+                # 固定檔數時與原本逐檔配對 put/call 的方式相同，取兩邊等長的部分
+                pair_count = min(len(put_snapshots), len(call_snapshots))
+                put_snapshots = put_snapshots[:pair_count]
+                call_snapshots = call_snapshots[:pair_count]
+            put_strikes, put_bids, put_asks, put_volumes = snapshots_to_arrays(put_snapshots)
+            call_strikes, call_bids, call_asks, call_volumes = snapshots_to_arrays(call_snapshots)
+
+            strikes = np.concatenate([put_strikes, call_strikes])
+            bids = np.concatenate([put_bids, call_bids])
+            asks = np.concatenate([put_asks, call_asks])
+            volumes = np.concatenate([put_volumes, call_volumes])
+            is_call = np.concatenate([np.zeros(len(put_strikes), dtype=bool), np.ones(len(call_strikes), dtype=bool)])
+
+            metrics = compute_chain_metrics(strikes, bids, asks, volumes, is_call, index_price)
+            put_otm_sum = metrics["put_otm_sum"]
+            call_otm_sum = metrics["call_otm_sum"]
+            otm_sum = metrics["otm_sum"]
+
+        label = width_label(width)
+        print(f"{target} put的{label}總和:{put_otm_sum}")
+        print(f"{target} call的{label}總和:{call_otm_sum}")
+        print(f"{target} {label}上下總和:{otm_sum}")
+
+        now = datetime.now()
+        with self.timer.stage("write"):
+            timestamp = self.write_record(target, now, self.timestamp_format, strikes, is_call, bids, asks,
+                                          put_otm_sum, call_otm_sum, otm_sum, metrics)
+
+        print(f"{target} {timestamp}資料儲存成功!")
+
+    def write_record(self, target, now, timestamp_format, strikes, is_call, bids, asks,
+                     put_otm_sum, call_otm_sum, otm_sum, metrics=None):
+        """寫入一筆價外紀錄到 JSON Lines 與欄位式資料庫，回傳紀錄的時間字串"""
+        timestamp = now.strftime(timestamp_format)
+        today = now.strftime("%Y-%m-%d")
+        date = now.strftime("%Y-%m")
         folder_name = f"{date}_{target}" 
-        base_folder = os.path.join(base_path, folder_name)
-        file_name = f"{today}_otm.json"
+        base_folder = os.path.join(self.base_path, folder_name)
+        file_name = f"{today}_otm.jsonl"
         file_path = os.path.join(base_folder, file_name)
 
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
-
-        # 讀取舊資料
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-        else:
-            existing_data = {}
+        otm_dic = dict(zip(np.asarray(strikes).tolist(), ((np.asarray(bids) + np.asarray(asks)) / 2).tolist()))
+        otm_dic = dict(sorted(otm_dic.items()))
 
-        existing_data[timestamp] = {
+        # 只附加這次的紀錄，讀取時用 load_otm_series 還原成 {時間: 紀錄}
+        record = {
             "otm_data": otm_dic,
             "otm_sum": otm_sum,
             "put_otm_sum": put_otm_sum,
-            "call_otm_sum": call_otm_sum
+            "call_otm_sum": call_otm_sum,
         }
-        
-        with open(file_path, "w", encoding="utf-8") as json_file:
-            json.dump(existing_data, json_file, indent=4)
-
-        print(f"{timestamp}資料儲存成功!")
+        if metrics is not None:
+            record["metrics"] = metrics
+        self.get_otm_writer(target).append(file_path, timestamp, record)
+
+        # 同步寫入欄位式資料庫，供 OtmColumnArchive 依時間/履約價區間查詢
+        archive = OtmColumnArchive(os.path.join(self.base_path, "otm_archive", target))
+        archive.append(now, strikes, np.asarray(is_call).astype(np.int8), bids, asks,
+                       put_otm_sum, call_otm_sum, otm_sum)
+        return timestamp
     
 
-class OptionAnalyzerApp(QWidget):
-
-    def __init__(self):
-        super().__init__()
+def main():
+    parser = argparse.ArgumentParser(description="台指選擇權價外資料收集 (不需 GUI)")
+    parser.add_argument("--daemon", action="store_true", help="常駐並依排程持續收集")
+    parser.add_argument("--interval", type=int, default=300, help="收集間隔秒數，預設 300")
+    parser.add_argument("--sessions", default="day,night", help="收集的交易時段: day, night")
+    parser.add_argument("--stream", action="store_true", help="改用 BidAsk 訂閱逐筆更新價外總和，每個間隔輸出一次")
+    parser.add_argument("--all-expiries", action="store_true", help="每輪並行收集所有到期，而非只收最近到期")
+    parser.add_argument("--workers", type=int, default=4, help="--all-expiries 的並行數，預設 4")
+    parser.add_argument("--width", type=int, default=25, help="價平上下收集的檔數，0 表示整條鏈")
+    parser.add_argument("--base-path", default=DEFAULT_BASE_PATH, help="資料、欄位式資料庫與 metrics 檔的輸出目錄")
+    args = parser.parse_args()
+    width = args.width or None
+
+    option_manager = OptionDataManager(base_path=args.base_path)
+
+    if args.stream:
+        option_manager.start_streaming(width)
+        job = option_manager.print_stream_sums
+    elif args.all_expiries:
+        job = lambda: option_manager.collect_all_expirations(args.workers, width)
+    else:
+        job = lambda: option_manager.get_contract_by_tv_ratio(width)
+
+    if not args.daemon and not args.stream:
+        job()
+        option_manager.close_writers()
+        return
+
+    if args.interval < 60:
+        option_manager.timestamp_format = "%Y-%m-%d %H:%M:%S"
+
+    scheduler = CollectorScheduler(
+        job,
+        interval=args.interval,
+        sessions=[name.strip() for name in args.sessions.split(",") if name.strip()],
+    )
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        scheduler.stop()
+    finally:
+        if args.stream:
+            option_manager.stop_streaming()
+        option_manager.close_writers()
 
-        self.option_manager = OptionDataManager()
-
-        self.api = self.option_manager.api
-
-        self.option_manager.get_contract_by_tv_ratio()
-
-        # self.refresh_timer = QTimer(self)
-        # self.refresh_timer.timeout.connect(self.option_manager.get_contract_by_tv_ratio)
-        # self.refresh_timer.start(300000)  # 每5分鐘更新一次
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = OptionAnalyzerApp()
-    sys.exit(app.exec())
-
+    main()
@@ -0,0 +1,27 @@
+import sys
+from PyQt6.QtWidgets import QApplication, QWidget
+from PyQt6.QtCore import QTimer
+from collect_otm_data import OptionDataManager
+
+
+class OptionAnalyzerApp(QWidget):
+
+    def __init__(self):
+        super().__init__()
+
+        self.option_manager = OptionDataManager()
+
+        self.api = self.option_manager.api
+
+        self.option_manager.get_contract_by_tv_ratio()
+
+        # self.refresh_timer = QTimer(self)
+        # self.refresh_timer.timeout.connect(self.option_manager.get_contract_by_tv_ratio)
+        # self.refresh_timer.start(300000)  # 每5分鐘更新一次
+
+
+if __name__ == '__main__':
+    app = QApplication(sys.argv)
+    window = OptionAnalyzerApp()
+    sys.exit(app.exec())
+
@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class StageTimer:
+    """記錄收集流程各階段的耗時：以累計計數輸出 Prometheus 直方圖，最近 window 筆只用於每輪摘要"""
+
+    def __init__(self, metrics_path=None, window=500, buckets=DEFAULT_BUCKETS, prefix="otm_collector"):
+        self.metrics_path = metrics_path
+        self.window = window
+        self.buckets = buckets
+        self.prefix = prefix
+        self.samples = {}       # 階段 -> 最近 window 筆耗時 (秒)，摘要用的滾動視窗
+        self.bucket_counts = {} # 階段 -> 各區間的累計筆數 (最後一格為 +Inf)，啟動後只增不減
+        self.totals = {}        # 階段 -> (累計筆數, 累計耗時)
+        self.current_run = {}   # 階段 -> 本輪累計耗時
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(seconds)
+
+            counts = self.bucket_counts.setdefault(name, [0] * (len(self.buckets) + 1))
+            counts[bisect_left(self.buckets, seconds)] += 1
+            count, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (count + 1, total + seconds)
+            self.current_run[name] = self.current_run.get(name, 0.0) + seconds
+
+    def summary_line(self):
+        with self.lock:
+            parts = [f"{name}={seconds * 1000:.1f}ms(p95 {self.percentile(name, 0.95) * 1000:.1f}ms)"
+                     for name, seconds in self.current_run.items()]
+        return " ".join(parts)
+
+    def percentile(self, name, q):
+        # 最近 window 筆的分位數，呼叫端需持有 lock
+        values = sorted(self.samples[name])
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    def end_run(self, label="", failed=False):
+        """輸出本輪摘要並更新 metrics 檔，再清空本輪累計；failed 時摘要標示本輪失敗"""
+        status = "失敗" if failed else ""
+        print(" ".join(part for part in ("[耗時]", label, status, self.summary_line()) if part))
+        if self.metrics_path:
+            try:
+                self.write_metrics()
+            except OSError as e:
+                print(f"寫入 metrics 檔失敗: {e}")
+        with self.lock:
+            self.current_run = {}
+
+    def prometheus_text(self):
+        name = f"{self.prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Collector stage latency since the collector started.",
+            f"# TYPE {name} histogram",
+        ]
+        with self.lock:
+            bucket_counts = {stage: list(counts) for stage, counts in self.bucket_counts.items()}
+            totals = dict(self.totals)
+
+        for stage, counts in bucket_counts.items():
+            # Prometheus 的 bucket 是 <= le 的累積筆數
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            count, total = totals[stage]
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        # 先寫暫存檔再取代，讓抓取 metrics 的程式不會讀到寫一半的檔案
+        os.makedirs(os.path.dirname(self.metrics_path) or ".", exist_ok=True)
+        tmp_path = f"{self.metrics_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, self.metrics_path)
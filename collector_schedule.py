@@ -0,0 +1,83 @@
+import threading
+from datetime import datetime, timedelta, time
+
+# 期交所交易時段，夜盤跨越午夜
+TRADING_SESSIONS = {
+    "day": (time(8, 45), time(13, 45)),
+    "night": (time(15, 0), time(5, 0)),
+}
+
+
+def in_session(now, sessions):
+    t = now.time()
+    weekday = now.weekday()
+
+    for name in sessions:
+        start, end = TRADING_SESSIONS[name]
+        if start <= end:
+            if weekday < 5 and start <= t <= end:
+                return True
+        else:
+            # 夜盤：週一到週五 15:00 開盤，收盤落在隔天 (週二到週六) 凌晨
+            if weekday < 5 and t >= start:
+                return True
+            if 1 <= weekday <= 5 and t <= end:
+                return True
+
+    return False
+
+
+def trading_day(now):
+    """now 所屬的交易日：15:00 夜盤開盤後算下一個交易日，週末順延到週一"""
+    day = now.date()
+    if now.time() >= TRADING_SESSIONS["night"][0]:
+        day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return day
+
+
+def next_boundary(now, interval):
+    """下一個對齊時鐘的執行時間，例如 interval=300 時為每個整 5 分"""
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (now - midnight).total_seconds()
+    return midnight + timedelta(seconds=(int(elapsed // interval) + 1) * interval)
+
+
+class CollectorScheduler:
+    """不需 QApplication 的排程器，依時鐘整點觸發，前一輪未完成時略過而不排隊"""
+
+    def __init__(self, job, interval=300, sessions=("day", "night")):
+        self.job = job
+        self.interval = interval
+        self.sessions = sessions
+        self.busy = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def run_forever(self):
+        while not self.stop_event.is_set():
+            # 每次都由目前時間重新計算下一個整點，執行時間長短不會累積誤差
+            target = next_boundary(datetime.now(), self.interval)
+            delay = (target - datetime.now()).total_seconds()
+            if self.stop_event.wait(max(delay, 0)):
+                break
+
+            if not in_session(target, self.sessions):
+                continue
+
+            if not self.busy.acquire(blocking=False):
+                print(f"{target:%H:%M:%S} 上一輪尚未完成，略過本次")
+                continue
+
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            self.job()
+        except Exception as e:
+            print(f"排程執行時出錯: {e}")
+        finally:
+            self.busy.release()
+
+    def stop(self):
+        self.stop_event.set()
@@ -0,0 +1,166 @@
+import os
+from datetime import datetime
+import numpy as np
+from collector_schedule import trading_day
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contract_cache")
+OPTION_CODES = ['TXO', 'TX1', 'TX2', 'TX4', 'TX5']
+
+COLUMNS = ("code", "symbol", "category", "delivery_date", "delivery_month", "strike", "right")
+
+
+def format_delivery_date(value):
+    """20250521 -> '2025/05/21'，與 contract.delivery_date 相同格式"""
+    value = int(value)
+    return f"{value // 10000:04d}/{value // 100 % 100:02d}/{value % 100:02d}"
+
+
+class ContractMaster:
+    """選擇權合約主檔，每個交易日存一份 npz，啟動時不必再走訪 api.Contracts.Options"""
+
+    def __init__(self, code, symbol, category, delivery_date, delivery_month, strike, right):
+        self.code = np.asarray(code, dtype=str)
+        self.symbol = np.asarray(symbol, dtype=str)
+        self.category = np.asarray(category, dtype=str)
+        self.delivery_date = np.asarray(delivery_date, dtype=np.int32)     # YYYYMMDD
+        self.delivery_month = np.asarray(delivery_month, dtype=str)
+        self.strike = np.asarray(strike, dtype=float)
+        self.right = np.asarray(right, dtype=np.int8)                      # 0: put, 1: call
+
+        self._build_indexes()
+
+    @classmethod
+    def from_api(cls, api, option_codes=OPTION_CODES):
+        rows = {name: [] for name in COLUMNS}
+
+        for code in option_codes:
+            if not hasattr(api.Contracts.Options, code):
+                continue
+            for contract in getattr(api.Contracts.Options, code):
+                rows["code"].append(contract.code)
+                rows["symbol"].append(contract.symbol)
+                rows["category"].append(contract.category)
+                rows["delivery_date"].append(int(contract.delivery_date.replace("/", "")))
+                rows["delivery_month"].append(contract.delivery_month)
+                rows["strike"].append(contract.strike_price)
+                rows["right"].append(1 if contract.symbol.endswith('C') else 0)
+
+        return cls(**rows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(**{name: data[name] for name in COLUMNS})
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, **{name: getattr(self, name) for name in COLUMNS})
+
+    def _build_indexes(self):
+        # 到期日清單：依日期排序，同日期時維持商品代碼的順序
+        seen = set()
+        expirations = []
+        for category, delivery_date in zip(self.category, self.delivery_date):
+            if (category, delivery_date) not in seen:
+                seen.add((category, delivery_date))
+                expirations.append((int(delivery_date), str(category)))
+        expirations.sort(key=lambda item: item[0])
+        self._expirations = [(category, format_delivery_date(date)) for date, category in expirations]
+
+    def expirations(self):
+        """[(商品代碼, 'YYYY/MM/DD')]，依到期日排序"""
+        return list(self._expirations)
+
+    def nearest_expiration(self):
+        return self._expirations[0] if self._expirations else None
+
+    def expiration_dates(self, since=None):
+        """不重複的到期日字串，since 之前已到期的略過"""
+        dates = sorted({date for _, date in self._expirations})
+        if since is not None:
+            since = since.strftime("%Y/%m/%d")
+            dates = [date for date in dates if date >= since]
+        return dates
+
+    def strikes_for_category(self, category, expiration=None, right=None):
+        """單一商品代碼的履約價，可再依到期日 ('YYYY/MM/DD') 與買賣權 ('C'/'P') 篩選"""
+        mask = self.category == category
+        if expiration is not None:
+            mask &= self.delivery_date == int(expiration.replace("/", ""))
+        if right is not None:
+            mask &= self.right == (1 if right == 'C' else 0)
+        return np.unique(self.strike[mask])
+
+
+def contracts_fetched(api):
+    """api.Contracts 是否已下載完成；舊版 shioaji 沒有 status 時視為完成"""
+    status = getattr(api.Contracts, "status", None)
+    return status is None or getattr(status, "value", status) == "Fetched"
+
+
+def load_contract_master(api, option_codes=OPTION_CODES, cache_dir=CACHE_DIR, day=None):
+    """讀取當日的合約主檔快取，沒有快取或讀取失敗時由 api 重建並寫入。
+    合約尚未下載完成時不寫快取，完全沒有合約時丟出 RuntimeError"""
+    # 預設以交易日為鍵：15:00 夜盤開始後算下一個交易日，到期日當晚重啟不會讀到早上已含到期合約的快取
+    day = day or trading_day(datetime.now())
+    # 商品代碼也列入檔名，不同程式用不同的代碼組合時不會互相讀到對方的快取
+    path = os.path.join(cache_dir, f"options_{'_'.join(option_codes)}_{day.strftime('%Y%m%d')}.npz")
+
+    if os.path.exists(path):
+        try:
+            master = ContractMaster.load(path)
+            if len(master.code):
+                return master
+            print(f"合約快取 {path} 是空的，重新建立")
+        except Exception as e:
+            print(f"讀取合約快取 {path} 失敗，重新建立: {e}")
+
+    fetched = contracts_fetched(api)
+    master = ContractMaster.from_api(api, option_codes)
+    if not len(master.code):
+        raise RuntimeError(f"沒有取得任何選擇權合約 ({', '.join(option_codes)})，請確認合約已下載完成")
+
+    if fetched:
+        master.save(path)
+    else:
+        print("合約尚未下載完成，這次不寫入快取")
+    return master
+
+
+class ContractIndex:
+    """(到期日, 履約價, 買賣權) -> 合約 的雜湊索引，登入後建立一次，之後查詢皆為 O(1)"""
+
+    def __init__(self, api, option_codes=('TX1', 'TX2', 'TX4', 'TX5', 'TXO')):
+        self.contracts = {}         # (到期日, 履約價, 'C'/'P') -> 合約
+        self.by_expiration = {}     # 到期日 -> [合約]
+        self.by_series = {}         # (商品代碼, 交割月份, 履約價, 'C'/'P') -> 合約，對應成交回報的欄位
+        strikes = {}
+
+        for code in option_codes:
+            if not hasattr(api.Contracts.Options, code):
+                continue
+            for contract in getattr(api.Contracts.Options, code):
+                right = 'C' if contract.symbol.endswith('C') else 'P'
+                strike = int(contract.strike_price)
+                # 同一組鍵保留第一個，與依序搜尋 option_codes 時取第一個符合的合約相同
+                self.contracts.setdefault((contract.delivery_date, strike, right), contract)
+                self.by_series.setdefault((contract.category, contract.delivery_month, strike, right), contract)
+                self.by_expiration.setdefault(contract.delivery_date, []).append(contract)
+                strikes.setdefault(contract.delivery_date, set()).add(strike)
+
+        self.strikes = {expiration: np.array(sorted(values), dtype=int) for expiration, values in strikes.items()}
+
+    def get(self, expiration, strike, opt_type):
+        right = 'C' if opt_type in ('Call', 'C') else 'P'
+        return self.contracts.get((expiration, int(strike), right))
+
+    def find_series(self, category, delivery_month, strike, option_right):
+        """由成交回報的 code/delivery_month/strike_price/option_right 找回合約"""
+        right = 'C' if 'Call' in str(option_right) else 'P'
+        return self.by_series.get((category, delivery_month, int(float(strike)), right))
+
+    def strikes_for(self, expiration):
+        return self.strikes.get(expiration, np.empty(0, dtype=int))
+
+    def contracts_for(self, expiration):
+        return self.by_expiration.get(expiration, [])
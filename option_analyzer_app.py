@@ -1,25 +1,42 @@
 import sys
 import os
+import itertools
 import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from PyQt6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QComboBox, QSplitter, QLineEdit, QMessageBox, QTableWidget, QTableWidgetItem, QHeaderView
+    QComboBox, QSplitter, QLineEdit, QMessageBox, QTableWidget, QTableWidgetItem, QHeaderView, QTabWidget,
+    QSlider, QFileDialog, QTableView, QAbstractItemView
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, QAbstractTableModel, QModelIndex
 from PyQt6.QtGui import QColor
 from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import shioaji as sj
+from contract_cache import load_contract_master, ContractIndex
+from snapshot_batch import QuoteCache
+from option_pricing import (years_to_expiry, fill_missing_vols, ImpliedVolCache,
+                            GreeksEngine, GREEK_NAMES, ScenarioEngine)
+from portfolio_analytics import (CONTRACT_SIZE, pack_positions, net_legs, leg_keys, net_breakdown,
+                                 theoretical_pnl, PortfolioCurve, PositionBook)
 
 # 設定中文字型
 plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
 plt.rcParams['axes.unicode_minus'] = False
 
-class OptionDataManager:
-    def __init__(self):
+SCENARIO_MOVES = np.linspace(-0.1, 0.1, 81)      # 標的變動 (相對目前價格)
+SCENARIO_VOL_SHIFTS = np.linspace(-0.1, 0.1, 21) # 波動率平移 (絕對值)
+SCENARIO_MAX_DAYS = 20
+PRICE_REFRESH_MS = 10_000                        # 目前價格的更新間隔
+
+
+class OptionDataManager(QObject):
+    positions_changed = pyqtSignal(object)  # 部位差異 {'added': [...], 'removed': [...]}
+
+    def __init__(self, quote_ttl=5.0):
+        super().__init__()
 
         self.api = sj.Shioaji()
 
@@ -34,6 +51,15 @@ class OptionDataManager:
             person_id="",
         )
 
+        self.contract_master = load_contract_master(self.api)
+        self.contract_index = ContractIndex(self.api)
+        self.quote_cache = QuoteCache(self.api, ttl=quote_ttl)
+        self.iv_cache = ImpliedVolCache()
+        self.position_book = PositionBook()
+        # 成交回報在券商的執行緒觸發，經由信號轉回 GUI 執行緒
+        self.position_book.subscribe(self.positions_changed.emit)
+        self.order_callback_set = False
+
     def get_positions(self):
         positions = self.api.list_positions(self.api.futopt_account)
         positions_data = []
@@ -60,8 +86,29 @@ class OptionDataManager:
                     'price': pos.price,
                     'source': '原始'
                 })
+
+        # 部位簿只在這裡建立一次，之後由成交回報更新
+        positions_data = self.position_book.seed(positions_data)
+        if not self.order_callback_set:
+            self.api.set_order_callback(self.on_order)
+            self.order_callback_set = True
         return positions_data
 
+    def on_order(self, stat, msg):
+        if stat != sj.constant.OrderState.FuturesDeal:
+            return
+        try:
+            contract = self.contract_index.find_series(msg['code'], msg['delivery_month'],
+                                                       msg['strike_price'], msg['option_right'])
+            if contract is None:
+                return
+            action = getattr(msg['action'], 'value', msg['action'])
+            self.position_book.apply_fill(contract.delivery_date, int(contract.strike_price),
+                                          'Call' if contract.symbol.endswith('C') else 'Put',
+                                          action, msg['quantity'], msg['price'])
+        except Exception as e:
+            print(f"處理成交回報時出錯: {e}")
+
     def get_current_price(self):
         try:
             future_contract = self.api.Contracts.Futures.TXF.TXFR1
@@ -73,60 +120,21 @@ class OptionDataManager:
             return None
 
     def get_all_expirations(self):
-        expirations = set()
-        today = datetime.now().date()
-        weekly_codes = ['TX1', 'TX2', 'TX4', 'TX5']
-        for code in weekly_codes:
-            if hasattr(self.api.Contracts.Options, code):
-                code_contracts = getattr(self.api.Contracts.Options, code)
-                for contract in code_contracts:
-                    expiration_date = datetime.strptime(contract.delivery_date, '%Y/%m/%d').date()
-                    if expiration_date >= today:
-                        expirations.add(contract.delivery_date)
-        txo_contracts = self.api.Contracts.Options.TXO
-        for contract in txo_contracts:
-            expiration_date = datetime.strptime(contract.delivery_date, '%Y/%m/%d').date()
-            if expiration_date >= today:
-                expirations.add(contract.delivery_date)
-        formatted_expirations = sorted(expirations)
-        return formatted_expirations
+        return self.contract_master.expiration_dates(since=datetime.now().date())
 
     def get_strike_prices_for_expiration(self, expiration):
-        strike_prices = set()
-        weekly_codes = ['TX1', 'TX2', 'TX4', 'TX5']
-        for code in weekly_codes:
-            if hasattr(self.api.Contracts.Options, code):
-                code_contracts = getattr(self.api.Contracts.Options, code)
-                for contract in code_contracts:
-                    if contract.delivery_date == expiration:
-                        strike_prices.add(int(contract.strike_price))
-        txo_contracts = self.api.Contracts.Options.TXO
-        for contract in txo_contracts:
-            if contract.delivery_date == expiration:
-                strike_prices.add(int(contract.strike_price))
-        if strike_prices:
-            return sorted(strike_prices)
-        else:
-            return []
+        return self.contract_index.strikes_for(expiration).tolist()
 
     def get_contract_price(self, expiration, strike, opt_type):
-        target_symbol = 'C' if opt_type == 'Call' else 'P'
-        candidates = []
-        weekly_codes = ['TX1', 'TX2', 'TX4', 'TX5']
-        for code in weekly_codes:
-            if hasattr(self.api.Contracts.Options, code):
-                code_contracts = getattr(self.api.Contracts.Options, code)
-                for c in code_contracts:
-                    if c.delivery_date == expiration and int(c.strike_price) == strike and c.symbol.endswith(target_symbol):
-                        candidates.append(c)
-        txo_contracts = self.api.Contracts.Options.TXO
-        for c in txo_contracts:
-            if c.delivery_date == expiration and int(c.strike_price) == strike and c.symbol.endswith(target_symbol):
-                candidates.append(c)
-        if not candidates:
+        contract = self.contract_index.get(expiration, strike, opt_type)
+        if contract is None:
+            return None
+        snapshot = self.quote_cache.get(contract)
+        if snapshot is None:
             return None
-        contract = candidates[0]
-        snapshot = self.api.snapshots([contract])[0]
+        return self.quote_mid(snapshot)
+
+    def quote_mid(self, snapshot):
         bid = snapshot.buy_price
         ask = snapshot.sell_price
         if bid and ask:
@@ -134,11 +142,107 @@ class OptionDataManager:
         else:
             return snapshot.close if snapshot.close else 0.0
 
+    def get_implied_vols(self, positions, forward):
+        """各部位合約的隱含波動率 {(到期日, 履約價, 類型): 波動率}，
+        報價取自快取，同一筆報價的波動率只解一次"""
+        contracts = {}
+        for pos in positions:
+            key = (pos['expiration'], pos['strike'], pos['type'])
+            if key not in contracts:
+                contracts[key] = self.contract_index.get(*key)
+        contracts = {key: contract for key, contract in contracts.items() if contract is not None}
+        self.quote_cache.prefetch(contracts.values())
+
+        leg_keys, quote_keys, mids = [], [], []
+        for key, contract in contracts.items():
+            snapshot = self.quote_cache.get(contract)
+            if snapshot is None:
+                continue
+            leg_keys.append(key)
+            quote_keys.append((contract.code, getattr(snapshot, 'ts', None)))
+            mids.append(self.quote_mid(snapshot))
+
+        if not leg_keys:
+            return {}
+        years = years_to_expiry([key[0] for key in leg_keys])
+        vols = self.iv_cache.solve(quote_keys, mids, forward,
+                                   [key[1] for key in leg_keys], years,
+                                   [key[2] == 'Call' for key in leg_keys])
+        return dict(zip(leg_keys, vols))
+
+    def prefetch_expiration(self, expiration):
+        """一次批次取得整個到期日的報價，之後切換履約價/類型直接由快取取價"""
+        self.quote_cache.prefetch(self.contract_index.contracts_for(expiration))
+
     def close(self):
         self.api.logout()
         print("已登出Shioaji API")
 
+class TaskSignals(QObject):
+    finished = pyqtSignal(int, object)  # 請求編號, 結果
+
+
+class BrokerTask(QRunnable):
+    """在背景執行緒呼叫券商 API，結果以信號送回 GUI 執行緒"""
+
+    def __init__(self, request_id, fn, args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.request_id = request_id
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args)
+        except Exception as e:
+            print(f"背景請求失敗: {e}")
+            result = None
+        self.signals.finished.emit(self.request_id, result)
+
+
+class BackgroundRequests(QObject):
+    """同一種請求只保留最新一筆：還在佇列的舊請求直接撤回，已在執行的舊請求結果到達時丟棄。
+    券商呼叫預設只用一條執行緒依序送出，避免同時對 API 發出多個請求"""
+
+    def __init__(self, max_threads=1, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self.request_ids = itertools.count(1)
+        self.latest = {}    # 種類 -> 最新的請求編號
+        self.pending = {}   # 請求編號 -> (種類, 工作, callback)
+
+    def submit(self, kind, fn, *args, callback=None):
+        previous = self.latest.get(kind)
+        if previous in self.pending and self.pool.tryTake(self.pending[previous][1]):
+            del self.pending[previous]
+
+        request_id = next(self.request_ids)
+        task = BrokerTask(request_id, fn, args)
+        task.signals.finished.connect(self.on_finished)
+        self.latest[kind] = request_id
+        self.pending[request_id] = (kind, task, callback)
+        self.pool.start(task)
+        return request_id
+
+    def on_finished(self, request_id, result):
+        kind, _, callback = self.pending.pop(request_id, (None, None, None))
+        if kind is None or self.latest.get(kind) != request_id:
+            return
+        if callback is not None:
+            callback(result)
+
+    def shutdown(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+
+
 class ProfitChartCanvas(FigureCanvasQTAgg):
+    """保留式繪圖：座標軸與各圖形物件只建立一次，之後只更新資料。
+    目前價格標記設為 animated，以 blitting 疊在快取的背景上，不必重繪整張圖"""
+
     def __init__(self, parent=None):
         fig = Figure(figsize=(8,6), dpi=100)
         self.axes = fig.add_subplot(111)
@@ -149,54 +253,297 @@ class ProfitChartCanvas(FigureCanvasQTAgg):
         self.axes.set_ylabel("盈虧 (NTD)")
         self.axes.grid(True)
 
+        self.lines = {}             # 到期日/Total -> Line2D
+        self.legend_labels = ()
+        self.fills = []
+        self.filled_curve = None    # 目前填色所依據的 (x, y)
+        self.total_curve = None
+
+        self.be_markers, = self.axes.plot([], [], 'go')
+        self.be_texts = []
+        self.stats_text = self.axes.text(0.95, 0.05, "", transform=self.axes.transAxes,
+                                         ha='right', va='bottom', fontsize=10,
+                                         bbox=dict(facecolor='white', alpha=0.7))
+        self.stats_text.set_visible(False)
+
+        # 標示目前價格的紅色點（不畫垂直線）
+        self.current_marker, = self.axes.plot([], [], 'ro', animated=True)
+        self.current_text = self.axes.text(0, 0, "", fontsize=10, ha='left', va='bottom',
+                                           bbox=dict(facecolor='white', alpha=0.7), animated=True)
+        self.current_text.set_visible(False)
+        self.current_price = None
+        self.background = None
+        self.mpl_connect('draw_event', self.on_draw)
+
     def plot_profit_curve(self, curves, current_price, max_profit, max_loss, breakeven_points):
-        self.axes.clear()
-        self.axes.set_title("損益圖")
+        self.update_lines(curves)
+        self.update_fills(curves.get('Total'))
+        self.update_breakevens(breakeven_points if curves else [])
+
+        if curves:
+            # 在圖的右下角顯示最大獲利/虧損資訊
+            self.stats_text.set_text(f"最大獲利: {'無限' if np.isinf(max_profit) else f'{max_profit:.2f}'}\n"
+                                     f"最大虧損: {'無限' if np.isinf(max_loss) else f'{max_loss:.2f}'}")
+        self.stats_text.set_visible(bool(curves))
+
+        self.total_curve = (curves['Total']['x'], curves['Total']['y']) if 'Total' in curves else None
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.set_current_price(current_price, redraw=False)
+        self.draw_idle()
+
+    def update_lines(self, curves):
+        for label in [label for label in self.lines if label not in curves]:
+            self.lines.pop(label).remove()
+
+        for label, data in curves.items():
+            color = data.get('color', 'blue')
+            linestyle = data.get('linestyle', '-')
+            if label in self.lines:
+                self.lines[label].set_data(data['x'], data['y'])
+                self.lines[label].set_color(color)
+                self.lines[label].set_linestyle(linestyle)
+            else:
+                self.lines[label], = self.axes.plot(data['x'], data['y'], label=label, color=color, linestyle=linestyle)
+
+        # 圖例只在曲線組合改變時重建
+        labels = tuple(curves)
+        if labels != self.legend_labels:
+            legend = self.axes.get_legend()
+            if legend is not None:
+                legend.remove()
+            if labels:
+                self.axes.legend(handles=[self.lines[label] for label in labels], loc='upper left', fontsize=10)
+            self.legend_labels = labels
+
+    def update_fills(self, total):
+        # 填充正負收益區域，Total 曲線沒變時保留原本的多邊形
+        curve = (total['x'], total['y']) if total else None
+        if self.filled_curve is not None and curve is not None \
+                and curve[0] is self.filled_curve[0] and curve[1] is self.filled_curve[1]:
+            return
+
+        for fill in self.fills:
+            fill.remove()
+        self.fills = []
+        self.filled_curve = curve
+        if curve is not None:
+            x, y = curve
+            self.fills = [self.axes.fill_between(x, y, where=(y>=0), color='green', alpha=0.2),
+                          self.axes.fill_between(x, y, where=(y<=0), color='red', alpha=0.2)]
+
+    def update_breakevens(self, breakeven_points):
+        # 損益平衡點
+        self.be_markers.set_data(list(breakeven_points), [0] * len(breakeven_points))
+        while len(self.be_texts) < len(breakeven_points):
+            self.be_texts.append(self.axes.text(0, 0, "", fontsize=9, color='green', ha='center', va='bottom',
+                                                bbox=dict(facecolor='white', alpha=0.7)))
+        for i, text in enumerate(self.be_texts):
+            if i < len(breakeven_points):
+                text.set_position((breakeven_points[i], 0))
+                text.set_text(f"BE:{breakeven_points[i]:.2f}")
+            text.set_visible(i < len(breakeven_points))
+
+    def set_current_price(self, current_price, redraw=True):
+        """只移動目前價格標記；背景已快取時以 blitting 更新"""
+        self.current_price = current_price
+        if current_price is not None and self.total_curve is not None:
+            cp_y = np.interp(current_price, *self.total_curve)
+            self.current_marker.set_data([current_price], [cp_y])
+            self.current_text.set_position((current_price, cp_y))
+            self.current_text.set_text(f"目前:{current_price:.2f}")
+            self.current_text.set_visible(True)
+        else:
+            self.current_marker.set_data([], [])
+            self.current_text.set_visible(False)
+
+        if not redraw:
+            return
+        if self.background is None:
+            self.draw_idle()
+            return
+        self.restore_region(self.background)
+        self.draw_animated()
+        self.blit(self.figure.bbox)
+
+    def on_draw(self, event):
+        # 每次完整重繪後重新擷取不含動態標記的背景
+        self.background = self.copy_from_bbox(self.figure.bbox)
+        self.draw_animated()
+
+    def draw_animated(self):
+        self.figure.draw_artist(self.current_marker)
+        self.figure.draw_artist(self.current_text)
+
+class GreeksChartCanvas(FigureCanvasQTAgg):
+    """投組 Greeks 對標的價格的曲線，四張子圖的線條只建立一次"""
+
+    TITLES = {'delta': "Delta (元/點)", 'gamma': "Gamma (元/點²)", 'theta': "Theta (元/日)", 'vega': "Vega (元/1%)"}
+
+    def __init__(self, parent=None):
+        fig = Figure(figsize=(8,6), dpi=100)
+        super().__init__(fig)
+        self.setParent(parent)
+        self.axes = dict(zip(GREEK_NAMES, fig.subplots(2, 2).ravel()))
+        self.lines = {}
+        self.spot_lines = {}
+        for name, axes in self.axes.items():
+            axes.set_title(self.TITLES[name], fontsize=10)
+            axes.grid(True)
+            axes.axhline(0, color='gray', linewidth=0.8)
+            self.lines[name], = axes.plot([], [], color='black')
+            self.spot_lines[name] = axes.axvline(0, color='red', linestyle=':', visible=False)
+        fig.tight_layout()
+
+    def plot_greeks(self, x, curves, current_price=None):
+        for name, axes in self.axes.items():
+            if x is None:
+                self.lines[name].set_data([], [])
+            else:
+                self.lines[name].set_data(x, curves[name])
+            self.spot_lines[name].set_visible(x is not None and current_price is not None)
+            if current_price is not None:
+                self.spot_lines[name].set_xdata([current_price, current_price])
+            axes.relim()
+            axes.autoscale_view()
+        self.draw_idle()
+
+
+class ScenarioHeatmapCanvas(FigureCanvasQTAgg):
+    """情境立方體的單一天數切片：X 為標的價格、Y 為波動率平移，影像物件只建立一次"""
+
+    def __init__(self, parent=None):
+        fig = Figure(figsize=(8,6), dpi=100)
+        self.axes = fig.add_subplot(111)
+        super().__init__(fig)
+        self.setParent(parent)
         self.axes.set_xlabel("標的價格")
-        self.axes.set_ylabel("盈虧 (NTD)")
-        self.axes.grid(True)
+        self.axes.set_ylabel("波動率變動 (%)")
+        self.image = None
+        self.colorbar = None
+
+    def plot_slice(self, pnl, prices, vol_shifts, limit, title):
+        extent = [prices[0], prices[-1], vol_shifts[0] * 100, vol_shifts[-1] * 100]
+        if self.image is None:
+            self.image = self.axes.imshow(pnl, origin='lower', aspect='auto', extent=extent, cmap='RdYlGn')
+            self.colorbar = self.figure.colorbar(self.image, ax=self.axes, label="盈虧 (NTD)")
+        else:
+            self.image.set_data(pnl)
+            self.image.set_extent(extent)
+        # 色階以整個立方體為準，拖動天數時顏色可直接比較
+        self.image.set_clim(-limit, limit)
+        self.colorbar.update_normal(self.image)
+        self.axes.set_title(title)
+        self.draw_idle()
 
-        if not curves:
-            self.draw()
+
+class VirtualPositionModel(QAbstractTableModel):
+    """虛擬部位清單的表格模型：新增/刪除只通知變動的列，不必重建整張表"""
+
+    HEADERS = ["到期日", "類型", "動作", "履約價", "數量", "價格"]
+
+    def __init__(self, positions, parent=None):
+        super().__init__(parent)
+        self.positions = positions  # 與 OptionAnalyzerApp.virtual_positions 為同一個 list
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.positions)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        pos = self.positions[index.row()]
+        column = index.column()
+        if column == 0:
+            return pos['expiration']
+        if column == 1:
+            return pos['type']
+        if column == 2:
+            return pos['action']
+        if column == 3:
+            return str(pos['strike'])
+        if column == 4:
+            return str(pos['quantity'])
+        return f"{pos['price']:.2f}"
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def extend(self, positions):
+        # 一次貼上多筆時只發出一次插入通知
+        if not positions:
             return
+        first = len(self.positions)
+        self.beginInsertRows(QModelIndex(), first, first + len(positions) - 1)
+        self.positions.extend(positions)
+        self.endInsertRows()
 
-        # 繪製曲線
-        for expiry, data in curves.items():
-            self.axes.plot(data['x'], data['y'], label=expiry, color=data.get('color','blue'))
+    def append(self, pos):
+        self.extend([pos])
 
-        # 標示目前價格的紅色點（不畫垂直線）
-        if current_price is not None and 'Total' in curves:
-            cp_y = np.interp(current_price, curves['Total']['x'], curves['Total']['y'])
-            self.axes.plot(current_price, cp_y, 'ro')
-            # 在紅色點附近加上文字
-            self.axes.text(current_price, cp_y, f"目前:{current_price:.2f}", fontsize=10, ha='left', va='bottom', bbox=dict(facecolor='white', alpha=0.7))
+    def remove_rows(self, rows):
+        """刪除指定的列並回傳被刪除的部位；由後往前刪，前面的列號不受影響"""
+        removed = []
+        for row in sorted(set(rows), reverse=True):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            removed.append(self.positions.pop(row))
+            self.endRemoveRows()
+        return removed
+
+
+class TextRowsModel(QAbstractTableModel):
+    """唯讀的文字表格模型：set_rows 與目前內容比對，只通知內容有變的列與增減的列"""
+
+    def __init__(self, headers, parent=None):
+        super().__init__(parent)
+        self.headers = headers
+        self.rows = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return self.rows[index.row()][index.column()]
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def set_rows(self, rows):
+        rows = [list(row) for row in rows]
+        common = min(len(rows), len(self.rows))
+
+        # 連續變動的列合併成一次 dataChanged
+        changed = [row for row in range(common) if rows[row] != self.rows[row]]
+        self.rows[:common] = rows[:common]
+        start = None
+        for i, row in enumerate(changed):
+            if start is None:
+                start = row
+            if i + 1 == len(changed) or changed[i + 1] != row + 1:
+                self.dataChanged.emit(self.index(start, 0), self.index(row, len(self.headers) - 1))
+                start = None
+
+        if len(rows) > common:
+            self.beginInsertRows(QModelIndex(), common, len(rows) - 1)
+            self.rows.extend(rows[common:])
+            self.endInsertRows()
+        elif len(self.rows) > common:
+            self.beginRemoveRows(QModelIndex(), common, len(self.rows) - 1)
+            del self.rows[common:]
+            self.endRemoveRows()
 
-        # 損益平衡點
-        if breakeven_points:
-            for bp in breakeven_points:
-                self.axes.plot(bp, 0, 'go')
-                self.axes.text(bp, 0, f"BE:{bp:.2f}", fontsize=9, color='green', ha='center', va='bottom', bbox=dict(facecolor='white', alpha=0.7))
-
-        # 填充正負收益區域
-        # 假設有'Total'曲線為主參考
-        if 'Total' in curves:
-            x = curves['Total']['x']
-            y = curves['Total']['y']
-            self.axes.fill_between(x, y, where=(y>=0), color='green', alpha=0.2)
-            self.axes.fill_between(x, y, where=(y<=0), color='red', alpha=0.2)
-
-        # 在圖的右下角顯示最大獲利/虧損資訊
-        self.axes.text(0.95, 0.05,
-                       f"最大獲利: {'無限' if np.isinf(max_profit) else f'{max_profit:.2f}'}\n"
-                       f"最大虧損: {'無限' if np.isinf(max_loss) else f'{max_loss:.2f}'}",
-                       transform=self.axes.transAxes,
-                       ha='right', va='bottom', fontsize=10,
-                       bbox=dict(facecolor='white', alpha=0.7))
-
-        # 調整legend
-        self.axes.legend(loc='upper left', fontsize=10)
-
-        self.draw()
 
 class OptionAnalyzerApp(QWidget):
     def __init__(self):
@@ -205,14 +552,27 @@ class OptionAnalyzerApp(QWidget):
         self.setGeometry(100, 100, 1600, 900)
 
         self.option_manager = OptionDataManager()
-        self.original_positions = self.option_manager.get_positions()
+        self.requests = BackgroundRequests(parent=self)
+        # 情境立方體是純計算，另開一組執行緒，不佔住券商請求的那條執行緒
+        self.compute_requests = BackgroundRequests(parent=self)
+        self.option_manager.positions_changed.connect(self.on_positions_changed)
+        # 部位與現價在背景取得，到達前先以空投組顯示
+        self.original_positions = []
         self.virtual_positions = []
-        self.current_price = self.option_manager.get_current_price()
+        self.current_price = None
         self.expirations = self.option_manager.get_all_expirations()
 
         self.max_profit = 0
         self.max_loss = 0
         self.breakeven_points = []
+        self.exact_analytics = True    # False 時改回以格點取樣估計
+        self.time_slices = []          # T+n 理論損益曲線的天數，空白表示只畫到期損益
+        self.leg_vols = {}             # (到期日, 履約價, 類型) -> 隱含波動率
+        self.greeks_engine = GreeksEngine()
+        self.scenario_engine = ScenarioEngine()
+        self.scenario = None           # 最近一次的情境立方體與各軸
+        self.original_curve = PortfolioCurve(self.original_positions, exact=self.exact_analytics)
+        self.adjusted_curve = PortfolioCurve(self.original_positions, exact=self.exact_analytics)
 
         self.init_ui()
 
@@ -220,6 +580,95 @@ class OptionAnalyzerApp(QWidget):
         self.update_original_chart()
         self.update_adjusted_chart()
 
+        self.requests.submit('positions', self.option_manager.get_positions, callback=self.on_positions_loaded)
+        self.request_current_price()
+
+        # 定期更新目前價格，曲線的密集區才會跟著價格移動
+        self.price_timer = QTimer(self)
+        self.price_timer.timeout.connect(self.request_current_price)
+        self.price_timer.start(PRICE_REFRESH_MS)
+
+    def request_current_price(self):
+        self.requests.submit('current_price', self.option_manager.get_current_price, callback=self.on_current_price)
+
+    def on_positions_loaded(self, positions):
+        if positions is None:
+            return
+        # 以部位簿的現況為準，載入期間已到達的成交不會被蓋掉
+        positions = self.option_manager.position_book.positions()
+        self.original_positions = positions
+        self.original_curve.rebuild(positions)
+        self.adjusted_curve.rebuild(positions + self.virtual_positions)
+        self.load_original_positions()
+        self.update_original_chart()
+        self.update_adjusted_chart()
+        self.refresh_implied_vols()
+
+    def on_positions_changed(self, diff):
+        """成交後只對變動的部位加減損益曲線，不重新查詢全部部位"""
+        for old in diff['removed']:
+            self.original_positions = [pos for pos in self.original_positions if pos is not old]
+            if any(pos is old for pos in self.original_curve.positions):
+                self.original_curve.remove(old)
+                self.adjusted_curve.remove(old)
+        for new in diff['added']:
+            self.original_positions.append(new)
+            self.original_curve.add(new)
+            self.adjusted_curve.add(new)
+
+        self.load_original_positions()
+        self.update_original_chart()
+        self.update_adjusted_chart()
+        self.refresh_implied_vols(diff['added'])
+
+    def on_current_price(self, price):
+        if price is None or price == self.current_price:
+            return
+        self.current_price = price
+        # 價格移出格點的密集區時重建曲線並重畫，否則只移動標記
+        if self.original_curve.recenter(price):
+            self.update_original_chart()
+        else:
+            self.original_canvas.set_current_price(price)
+        if self.adjusted_curve.recenter(price):
+            self.update_adjusted_chart()
+        else:
+            self.adjusted_canvas.set_current_price(price)
+        self.update_greeks()
+        self.refresh_implied_vols()
+
+    def update_time_slices(self):
+        text = self.slice_input.text().replace('，', ',')
+        try:
+            days = sorted({float(v) for v in text.split(',') if v.strip()})
+        except ValueError:
+            QMessageBox.warning(self, "輸入錯誤", "請輸入以逗號分隔的天數，例如 0,2。")
+            return
+        if days == self.time_slices:
+            return
+        self.time_slices = days
+        self.refresh_implied_vols()
+        self.update_adjusted_chart()
+
+    def refresh_implied_vols(self, positions=None):
+        # 隱含波動率以 TXFR1 為遠期價格，在背景取報價並求解；T+n 曲線與 Greeks 共用。
+        # 只傳入新增的部位時另用一個請求種類，不會取代進行中的全量更新
+        if self.current_price is None:
+            return
+        kind = 'vols' if positions is None else 'new_leg_vols'
+        if positions is None:
+            positions = self.original_positions + self.virtual_positions
+        if not positions:
+            return
+        self.requests.submit(kind, self.option_manager.get_implied_vols, positions, self.current_price,
+                             callback=self.on_implied_vols)
+
+    def on_implied_vols(self, vols):
+        if not vols:
+            return
+        self.leg_vols.update(vols)
+        self.update_adjusted_chart()
+
     def init_ui(self):
         main_layout = QHBoxLayout(self)
 
@@ -257,11 +706,59 @@ class OptionAnalyzerApp(QWidget):
             self.expiry_filter_combo.addItem(exp)
         self.expiry_filter_combo.currentIndexChanged.connect(self.update_adjusted_chart)
         top_control_layout.addWidget(self.expiry_filter_combo)
+        top_control_layout.addWidget(QLabel("T+n 天數:"))
+        self.slice_input = QLineEdit()
+        self.slice_input.setPlaceholderText("例如 0,2 (0 為現在)")
+        self.slice_input.editingFinished.connect(self.update_time_slices)
+        top_control_layout.addWidget(self.slice_input)
         right_layout.addLayout(top_control_layout)
 
         self.adjusted_canvas = ProfitChartCanvas(right_widget)
+        self.greeks_canvas = GreeksChartCanvas(right_widget)
+        self.greeks_model = TextRowsModel(["來源", "到期日", "類型", "履約價", "數量",
+                                           "Delta", "Gamma", "Theta(日)", "Vega(1%)"], self)
+        self.greeks_table = QTableView()
+        self.greeks_table.setModel(self.greeks_model)
+        self.greeks_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.greeks_table.verticalHeader().setDefaultSectionSize(25)
+
+        greeks_widget = QWidget()
+        greeks_layout = QVBoxLayout(greeks_widget)
+        greeks_layout.addWidget(self.greeks_canvas)
+        greeks_layout.addWidget(self.greeks_table)
+
+        chart_tabs = QTabWidget()
+        chart_tabs.addTab(self.adjusted_canvas, "損益圖")
+        chart_tabs.addTab(greeks_widget, "Greeks")
+
+        self.net_model = TextRowsModel(["到期日", "類型", "履約價", "淨數量", "均價", "原始", "虛擬"], self)
+        self.net_table = QTableView()
+        self.net_table.setModel(self.net_model)
+        self.net_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.net_table.verticalHeader().setDefaultSectionSize(25)
+        chart_tabs.addTab(self.net_table, "淨部位")
+
+        scenario_widget = QWidget()
+        scenario_layout = QVBoxLayout(scenario_widget)
+        self.scenario_canvas = ScenarioHeatmapCanvas(scenario_widget)
+        scenario_layout.addWidget(self.scenario_canvas)
+        scenario_controls = QHBoxLayout()
+        scenario_button = QPushButton("計算情境")
+        scenario_button.clicked.connect(self.compute_scenarios)
+        scenario_controls.addWidget(scenario_button)
+        self.scenario_day_label = QLabel("T+0")
+        scenario_controls.addWidget(self.scenario_day_label)
+        self.scenario_slider = QSlider(Qt.Orientation.Horizontal)
+        self.scenario_slider.setRange(0, 0)
+        self.scenario_slider.valueChanged.connect(self.show_scenario_slice)
+        scenario_controls.addWidget(self.scenario_slider)
+        export_button = QPushButton("匯出")
+        export_button.clicked.connect(self.export_scenarios)
+        scenario_controls.addWidget(export_button)
+        scenario_layout.addLayout(scenario_controls)
+        chart_tabs.addTab(scenario_widget, "情境")
         right_layout.addWidget(QLabel("調整後投組損益圖"))
-        right_layout.addWidget(self.adjusted_canvas)
+        right_layout.addWidget(chart_tabs)
 
         # 控制面板 (新增/刪除虛擬部位)
         control_panel = QWidget()
@@ -309,10 +806,12 @@ class OptionAnalyzerApp(QWidget):
 
         right_layout.addWidget(control_panel)
 
-        self.virtual_table = QTableWidget()
-        self.virtual_table.setColumnCount(7)
-        self.virtual_table.setHorizontalHeaderLabels(["到期日", "類型", "動作", "履約價", "數量", "價格", "選擇"])
+        self.virtual_model = VirtualPositionModel(self.virtual_positions, self)
+        self.virtual_table = QTableView()
+        self.virtual_table.setModel(self.virtual_model)
+        self.virtual_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
         self.virtual_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.virtual_table.verticalHeader().setDefaultSectionSize(25)
         right_layout.addWidget(QLabel("虛擬部位"))
         right_layout.addWidget(self.virtual_table)
 
@@ -335,26 +834,11 @@ class OptionAnalyzerApp(QWidget):
             self.original_table.setItem(row, 5, QTableWidgetItem(f"{pos['price']:.2f}"))
             self.original_table.setRowHeight(row, 25)
 
-    def load_virtual_positions(self):
-        positions = self.virtual_positions
-        self.virtual_table.setRowCount(0)
-        for idx, pos in enumerate(positions):
-            row = self.virtual_table.rowCount()
-            self.virtual_table.insertRow(row)
-            self.virtual_table.setItem(row, 0, QTableWidgetItem(pos['expiration']))
-            self.virtual_table.setItem(row, 1, QTableWidgetItem(pos['type']))
-            self.virtual_table.setItem(row, 2, QTableWidgetItem(pos['action']))
-            self.virtual_table.setItem(row, 3, QTableWidgetItem(str(pos['strike'])))
-            self.virtual_table.setItem(row, 4, QTableWidgetItem(str(pos['quantity'])))
-            self.virtual_table.setItem(row, 5, QTableWidgetItem(f"{pos['price']:.2f}"))
-            select_button = QPushButton("選擇")
-            select_button.clicked.connect(lambda checked, i=idx: self.select_virtual_position(i))
-            self.virtual_table.setCellWidget(row, 6, select_button)
-            self.virtual_table.setRowHeight(row, 25)
-
     def update_strike_prices(self):
         expiration = self.expiry_combo.currentText()
         strikes = self.option_manager.get_strike_prices_for_expiration(expiration)
+        # 排在取價之前，之後的取價直接命中快取
+        self.requests.submit('prefetch', self.option_manager.prefetch_expiration, expiration)
         self.strike_combo.clear()
         for s in strikes:
             self.strike_combo.addItem(str(s))
@@ -369,7 +853,11 @@ class OptionAnalyzerApp(QWidget):
         if not strike_text.isdigit():
             return
         strike = int(strike_text)
-        price = self.option_manager.get_contract_price(expiration, strike, opt_type)
+        # 快速捲動履約價時只有最後一個請求會被送出/採用
+        self.requests.submit('price', self.option_manager.get_contract_price, expiration, strike, opt_type,
+                             callback=self.on_contract_price)
+
+    def on_contract_price(self, price):
         if price is not None:
             self.sell_price_input.setText(f"{price:.2f}")
 
@@ -405,22 +893,20 @@ class OptionAnalyzerApp(QWidget):
             'source': '虛擬'
         }
 
-        self.virtual_positions.append(new_pos)
+        self.virtual_model.append(new_pos)
+        self.adjusted_curve.add(new_pos)
         self.update_adjusted_chart()
+        self.refresh_implied_vols()
 
     def remove_selected_virtual_position(self):
         selected_indexes = self.virtual_table.selectionModel().selectedRows()
         if not selected_indexes:
             QMessageBox.warning(self, "未選擇", "請先選擇要刪除的虛擬部位。")
             return
-        for index in sorted(selected_indexes, reverse=True):
-            row = index.row()
-            self.virtual_positions.pop(row)
+        for pos in self.virtual_model.remove_rows(index.row() for index in selected_indexes):
+            self.adjusted_curve.remove(pos)
         self.update_adjusted_chart()
 
-    def select_virtual_position(self, index):
-        self.virtual_table.selectRow(index)
-
     def is_float(self, value):
         try:
             float(value)
@@ -428,106 +914,47 @@ class OptionAnalyzerApp(QWidget):
         except:
             return False
 
-    def calculate_pnl_curve(self, positions, price_range=None):
-
-        # 新的X軸計算方式：依據所有部位的最高最低履約價決定
-        all_strikes = [p['strike'] for p in positions] if positions else []
-        if not all_strikes:
+    def time_slice_curves(self, portfolio, expiry=None):
+        """T+n 天的理論損益曲線 (虛線)，到期損益仍由 portfolio_curves 提供"""
+        days = self.time_slices
+        if not days or portfolio.x is None:
+            return {}
+        positions = [pos for pos in portfolio.positions if expiry is None or pos['expiration'] == expiry]
+        if not positions:
             return {}
-        min_strike = min(all_strikes)
-        max_strike = max(all_strikes)
-        # x範圍
-        low = min_strike * 0.99
-        high = max_strike * 1.01
-        price_range = np.linspace(low, high, 500)
-
-        grouped = {}
-        for pos in positions:
-            expiry = pos['expiration']
-            if expiry not in grouped:
-                grouped[expiry] = []
-            grouped[expiry].append(pos)
 
-        contract_size = 50
-        curves = {}
-        total_y = np.zeros_like(price_range, dtype=float)
-        # global_y_values = []
-        colors = plt.cm.tab10(np.linspace(0,1,len(grouped)))
-
-        for i, (expiry, pos_list) in enumerate(grouped.items()):
-            y = np.zeros_like(price_range, dtype=float)
-            for pos in pos_list:
-                strike = pos['strike']
-                qty = pos['quantity']
-                price = pos['price']
-                action = pos['action']
-                if pos['type'] == 'Call':
-                    if action == 'Sell':
-                        payoff = (price*qty*contract_size) - np.maximum(price_range - strike, 0)*qty*contract_size
-                    else:
-                        payoff = (-price*qty*contract_size) + np.maximum(price_range - strike, 0)*qty*contract_size
-                else: # Put
-                    if action == 'Sell':
-                        payoff = (price*qty*contract_size) - np.maximum(strike - price_range, 0)*qty*contract_size
-                    else:
-                        payoff = (-price*qty*contract_size) + np.maximum(strike - price_range, 0)*qty*contract_size
-                y += payoff
-            curves[expiry] = {'x': price_range, 'y': y, 'color': colors[i]}
-            total_y += y
-            # global_y_values.extend(y)
-
-
-        if grouped:
-            curves['Total'] = {'x': price_range, 'y': total_y, 'color': 'black'}
-            # global_y_values.extend(total_y)
-
-        # if global_y_values:
-        #     max_profit = max(global_y_values)
-        #     min_loss = min(global_y_values)
-
-        if 'Total' in curves:
-            max_profit = np.max(total_y)
-            min_loss = np.min(total_y)
+        legs, _ = net_legs(pack_positions(positions))
+        vols = fill_missing_vols([self.leg_vols.get(key, np.nan) for key in leg_keys(legs)])
+        years = years_to_expiry(legs['expiries'])[legs['expiry_id']]
+        remaining = np.maximum(years[None, :] - np.asarray(days, dtype=float)[:, None] / 365, 0)
+        ys = theoretical_pnl(legs, portfolio.x, remaining, vols)
 
-        else:
-            max_profit = 0
-            min_loss = 0
+        colors = plt.cm.plasma(np.linspace(0, 0.8, len(days)))
+        return {f"T+{d:g}": {'x': portfolio.x, 'y': y, 'color': colors[i], 'linestyle': '--'}
+                for i, (d, y) in enumerate(zip(days, ys))}
 
-        # 無限判斷(簡化)
-        if len(price_range) > 2 and 'Total' in curves:
-            if total_y[-1] > total_y[-2] + 1000:
-                max_profit = float('inf')
-            if total_y[0] < total_y[1] - 1000:
-                min_loss = float('-inf')
+    def portfolio_curves(self, portfolio):
+        if portfolio.x is None:
+            self.max_profit, self.max_loss, self.breakeven_points = 0, 0, []
+            return {}
 
-        # 損益平衡點
-        breakevens = []
-        if 'Total' in curves:
-            total_arr = total_y
-            for i in range(len(total_arr)-1):
-                if total_arr[i]*total_arr[i+1] < 0:
-                    x0 = price_range[i]
-                    x1 = price_range[i+1]
-                    y0 = total_arr[i]
-                    y1 = total_arr[i+1]
-                    bp = x0 - (y0*(x1 - x0)/(y1 - y0))
-                    breakevens.append(bp)
-        else:
-            breakevens = []
+        colors = plt.cm.tab10(np.linspace(0,1,len(portfolio.expiry_y)))
+        curves = {}
+        for i, (expiry, y) in enumerate(portfolio.expiry_y.items()):
+            curves[expiry] = {'x': portfolio.x, 'y': y, 'color': colors[i]}
+        curves['Total'] = {'x': portfolio.x, 'y': portfolio.total_y, 'color': 'black'}
 
-        self.max_profit = max_profit
-        self.max_loss = min_loss
-        self.breakeven_points = breakevens
+        self.max_profit, self.max_loss, self.breakeven_points = portfolio.stats()
 
         return curves
 
     def update_original_chart(self):
-        curves = self.calculate_pnl_curve(self.original_positions)
+        # 原始投組曲線只在部位載入時重建，這裡只負責繪製
+        curves = self.portfolio_curves(self.original_curve)
         self.original_canvas.plot_profit_curve(curves, self.current_price, self.max_profit, self.max_loss, self.breakeven_points)
 
     def update_adjusted_chart(self):
-        combined_positions = self.original_positions + self.virtual_positions
-        all_curves = self.calculate_pnl_curve(combined_positions)
+        all_curves = self.portfolio_curves(self.adjusted_curve)
 
         selected_exp = self.expiry_filter_combo.currentText()
         if selected_exp == "總圖":
@@ -537,36 +964,136 @@ class OptionAnalyzerApp(QWidget):
             show_bes = self.breakeven_points
         else:
             if selected_exp in all_curves:
-                x = all_curves[selected_exp]['x']
-                y = all_curves[selected_exp]['y']
-                max_p = max(y) if len(y)>0 else 0
-                min_p = min(y) if len(y)>0 else 0
-                if len(x)>2:
-                    if y[-1] > y[-2] + 1000:
-                        max_p = float('inf')
-                    if y[0] < y[1] - 1000:
-                        min_p = float('-inf')
-                bes = []
-                for i in range(len(y)-1):
-                    if y[i]*y[i+1]<0:
-                        x0,x1 = x[i],x[i+1]
-                        y0,y1 = y[i],y[i+1]
-                        bp = x0 - (y0*(x1 - x0)/(y1 - y0))
-                        bes.append(bp)
                 filtered_curves = {selected_exp: all_curves[selected_exp]}
-                show_max_profit = max_p
-                show_max_loss = min_p
-                show_bes = bes
+                show_max_profit, show_max_loss, show_bes = self.adjusted_curve.stats(selected_exp)
             else:
                 filtered_curves = {}
                 show_max_profit = 0
                 show_max_loss = 0
                 show_bes = []
 
+        if filtered_curves:
+            filtered_curves = dict(filtered_curves)
+            filtered_curves.update(self.time_slice_curves(self.adjusted_curve,
+                                                          expiry=None if selected_exp == "總圖" else selected_exp))
+
         self.adjusted_canvas.plot_profit_curve(filtered_curves, self.current_price, show_max_profit, show_max_loss, show_bes)
-        self.load_virtual_positions()
+        self.update_greeks()
+        self.load_net_positions()
+
+    def load_net_positions(self):
+        # 損益以淨部位計算，這裡列出各合約的淨數量與原始/虛擬的來源明細
+        self.net_model.set_rows(
+            [item['expiration'], item['type'], str(item['strike']), f"{item['net_quantity']:g}",
+             f"{item['avg_price']:.2f}" if item['net_quantity'] else "-",
+             f"{item['sources'].get('原始', 0):g}", f"{item['sources'].get('虛擬', 0):g}"]
+            for item in net_breakdown(self.adjusted_curve.positions))
+
+    def calculate_greeks(self, positions, price_range):
+        """各部位在目前價格的 Greeks (部位數) 與在價格格點上的 Greeks (部位數 x 價格點數)，
+        已乘上買賣方向、數量與契約乘數；同一合約只算一次且由 GreeksEngine 快取"""
+        keys = [(pos['expiration'], pos['strike'], pos['type']) for pos in positions]
+        contracts = list(dict.fromkeys(keys))
+        # 剩餘時間取到分鐘，同一分鐘內沒變動的合約不必重算
+        now = datetime.now().replace(second=0, microsecond=0)
+        years = years_to_expiry([key[0] for key in contracts], now)
+        vols = fill_missing_vols([self.leg_vols.get(key, np.nan) for key in contracts])
+        spot = self.current_price if self.current_price is not None else np.nan
+        points = np.concatenate([[spot], price_range])
+
+        greeks = self.greeks_engine.evaluate(contracts, [key[1] for key in contracts],
+                                             [key[2] == 'Call' for key in contracts], years, vols, points)
+
+        index = {key: i for i, key in enumerate(contracts)}
+        rows = np.array([index[key] for key in keys])
+        scale = np.array([(1 if pos['action'] == 'Buy' else -1) * pos['quantity'] * CONTRACT_SIZE
+                          for pos in positions], dtype=float)
+        at_spot = {name: scale * values[rows, 0] for name, values in greeks.items()}
+        on_grid = {name: scale[:, None] * values[rows, 1:] for name, values in greeks.items()}
+        return at_spot, on_grid
+
+    def compute_scenarios(self):
+        """標的變動 x 波動率平移 x 天數 的損益立方體，在背景計算；同一組部位與參數直接取快取"""
+        positions = self.adjusted_curve.positions
+        if not positions or self.current_price is None:
+            QMessageBox.warning(self, "無法計算", "需要部位與目前價格才能計算情境。")
+            return
+
+        # 同一合約的部位先合併成淨數量
+        legs, _ = net_legs(pack_positions(positions))
+        net_scale = legs['sign'] * legs['quantity'] * CONTRACT_SIZE
+        cost = float(legs['cost'].sum())
+
+        contracts = leg_keys(legs)
+        now = datetime.now().replace(second=0, microsecond=0)
+        years = years_to_expiry([key[0] for key in contracts], now)
+        vols = fill_missing_vols([self.leg_vols.get(key, np.nan) for key in contracts])
+        spot = self.current_price
+        moves = spot * SCENARIO_MOVES
+        days = np.arange(min(int(np.ceil(years.max() * 365)), SCENARIO_MAX_DAYS) + 1)
+
+        key = (tuple(zip(contracts, net_scale.tolist(), vols.tolist())), cost, spot, now)
+        axes = (spot + moves, SCENARIO_VOL_SHIFTS, days)
+        self.compute_requests.submit('scenario', self.scenario_engine.compute, key,
+                                     legs['strike'], legs['is_call'], net_scale, cost, years, vols,
+                                     spot, moves, SCENARIO_VOL_SHIFTS, days,
+                                     callback=lambda cube, axes=axes: self.on_scenarios(cube, *axes))
+
+    def on_scenarios(self, cube, prices, vol_shifts, days):
+        if cube is None:
+            return
+        self.scenario = {'pnl': cube, 'prices': prices, 'vol_shifts': vol_shifts, 'days': days,
+                         'limit': float(np.abs(cube).max()) or 1.0}
+        self.scenario_slider.setRange(0, len(days) - 1)
+        self.show_scenario_slice()
+
+    def show_scenario_slice(self):
+        # 拖動滑桿只切已算好的立方體
+        if self.scenario is None:
+            return
+        index = min(self.scenario_slider.value(), len(self.scenario['days']) - 1)
+        day = self.scenario['days'][index]
+        self.scenario_day_label.setText(f"T+{day:g}")
+        self.scenario_canvas.plot_slice(self.scenario['pnl'][index], self.scenario['prices'],
+                                        self.scenario['vol_shifts'], self.scenario['limit'], f"情境損益 T+{day:g}")
+
+    def export_scenarios(self):
+        if self.scenario is None:
+            QMessageBox.warning(self, "無資料", "請先計算情境。")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "匯出情境", "scenario.npz", "NumPy (*.npz)")
+        if path:
+            np.savez(path, pnl=self.scenario['pnl'], prices=self.scenario['prices'],
+                     vol_shifts=self.scenario['vol_shifts'], days=self.scenario['days'])
+
+    def update_greeks(self):
+        positions = self.adjusted_curve.positions
+        if not positions or self.adjusted_curve.x is None:
+            self.greeks_model.set_rows([])
+            self.greeks_canvas.plot_greeks(None, {})
+            return
+
+        at_spot, on_grid = self.calculate_greeks(positions, self.adjusted_curve.x)
+        self.greeks_canvas.plot_greeks(self.adjusted_curve.x,
+                                       {name: values.sum(axis=0) for name, values in on_grid.items()},
+                                       self.current_price)
+
+        rows = [[pos['source'], pos['expiration'], pos['type'], str(pos['strike']), str(pos['quantity'])] +
+                [at_spot[name][i] for name in GREEK_NAMES] for i, pos in enumerate(positions)]
+        for expiry in dict.fromkeys(pos['expiration'] for pos in positions):
+            mask = np.array([pos['expiration'] == expiry for pos in positions])
+            rows.append(["小計", expiry, "", "", ""] + [at_spot[name][mask].sum() for name in GREEK_NAMES])
+        rows.append(["總計", "", "", "", ""] + [at_spot[name].sum() for name in GREEK_NAMES])
+
+        # 價格更新時通常只有 Greeks 數值變動，模型只通知有變的列
+        self.greeks_model.set_rows(
+            [value if isinstance(value, str) else ("-" if np.isnan(value) else f"{value:.2f}") for value in values]
+            for values in rows)
 
     def closeEvent(self, event):
+        self.price_timer.stop()
+        self.requests.shutdown()
+        self.compute_requests.shutdown()
         self.option_manager.close()
         event.accept()
 
@@ -0,0 +1,248 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+
+RISK_FREE_RATE = 0.015      # 年化無風險利率，只影響折現，取固定值即可
+DEFAULT_VOL = 0.2           # 解不出隱含波動率時的預設值
+MIN_VOL = 0.005
+MAX_VOL = 5.0
+SETTLEMENT_TIME = (13, 30)  # 台指選擇權到期日 13:30 結算
+YEAR_SECONDS = 365 * 24 * 3600
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    # Abramowitz & Stegun 26.2.17，誤差 < 7.5e-8，不必為了 erf 引入 scipy
+    x = np.asarray(x, dtype=float)
+    t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = norm_pdf(x) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def years_to_expiry(expirations, now=None):
+    """到期日字串 ('YYYY/MM/DD') -> 距結算的年數，已過結算為 0"""
+    now = now or datetime.now()
+    hour, minute = SETTLEMENT_TIME
+    seconds = [(datetime.strptime(expiration, "%Y/%m/%d").replace(hour=hour, minute=minute) - now).total_seconds()
+               for expiration in expirations]
+    return np.maximum(np.array(seconds, dtype=float), 0.0) / YEAR_SECONDS
+
+
+def _d1_d2(forward, strike, years, vol):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = vol * np.sqrt(years)
+        d1 = (np.log(forward / strike) + 0.5 * std * std) / std
+    return d1, d1 - std, std
+
+
+def black76_price(forward, strike, years, vol, is_call, rate=RISK_FREE_RATE):
+    """Black-76 期貨選擇權理論價，所有參數可廣播；years 為 0 時回傳內含價值"""
+    forward, strike, years, vol = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (forward, strike, years, vol)))
+    is_call = np.broadcast_to(is_call, forward.shape)
+    d1, d2, std = _d1_d2(forward, strike, years, vol)
+    discount = np.exp(-rate * years)
+
+    call = discount * (forward * norm_cdf(d1) - strike * norm_cdf(d2))
+    put = discount * (strike * norm_cdf(-d2) - forward * norm_cdf(-d1))
+    price = np.where(is_call, call, put)
+
+    intrinsic = np.where(is_call, np.maximum(forward - strike, 0), np.maximum(strike - forward, 0))
+    return np.where(std > 0, price, intrinsic)
+
+
+def black76_vega(forward, strike, years, vol, rate=RISK_FREE_RATE):
+    d1, _, std = _d1_d2(forward, strike, years, vol)
+    vega = np.exp(-rate * years) * forward * norm_pdf(d1) * np.sqrt(years)
+    return np.where(std > 0, vega, 0.0)
+
+
+def implied_vol(price, forward, strike, years, is_call, rate=RISK_FREE_RATE, iterations=60, tol=1e-6):
+    """批次解隱含波動率：牛頓法，跳出 [下界, 上界] 時改用二分法。
+    價格低於內含價值或高於理論上限的回傳 nan"""
+    price, forward, strike, years = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (price, forward, strike, years)))
+    is_call = np.broadcast_to(is_call, price.shape)
+
+    discount = np.exp(-rate * years)
+    intrinsic = discount * np.where(is_call, np.maximum(forward - strike, 0), np.maximum(strike - forward, 0))
+    upper = discount * np.where(is_call, forward, strike)
+    valid = (years > 0) & (price > intrinsic) & (price < upper)
+
+    lo = np.full(price.shape, MIN_VOL)
+    hi = np.full(price.shape, MAX_VOL)
+    vol = np.full(price.shape, DEFAULT_VOL)
+
+    for _ in range(iterations):
+        diff = black76_price(forward, strike, years, vol, is_call, rate) - price
+        if np.all(np.abs(diff[valid]) < tol):
+            break
+        # 理論價隨波動率遞增，依誤差符號縮小區間
+        hi = np.where(diff > 0, vol, hi)
+        lo = np.where(diff < 0, vol, lo)
+
+        vega = black76_vega(forward, strike, years, vol, rate)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = vol - diff / vega
+        vol = np.where((vega > 1e-12) & (step > lo) & (step < hi), step, 0.5 * (lo + hi))
+
+    return np.where(valid, vol, np.nan)
+
+
+class ImpliedVolCache:
+    """以 (合約代碼, 報價時間) 為鍵的隱含波動率，同一筆報價只解一次"""
+
+    def __init__(self, max_entries=5000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def solve(self, keys, prices, forward, strikes, years, is_call):
+        """keys 為 [(合約代碼, 報價時間)]，只對快取沒有的部分批次求解"""
+        with self.lock:
+            missing = [i for i, key in enumerate(keys) if key not in self.entries]
+
+        if missing:
+            vols = implied_vol(np.asarray(prices, dtype=float)[missing], forward,
+                               np.asarray(strikes, dtype=float)[missing],
+                               np.asarray(years, dtype=float)[missing],
+                               np.asarray(is_call, dtype=bool)[missing])
+            with self.lock:
+                if len(self.entries) + len(missing) > self.max_entries:
+                    self.entries.clear()
+                for i, vol in zip(missing, vols):
+                    self.entries[keys[i]] = float(vol)
+
+        with self.lock:
+            return np.array([self.entries.get(key, np.nan) for key in keys])
+
+
+def fill_missing_vols(vols):
+    """解不出的腿以其他腿的中位數補上，全部解不出時用預設值"""
+    vols = np.asarray(vols, dtype=float)
+    solved = vols[np.isfinite(vols)]
+    fallback = float(np.median(solved)) if len(solved) else DEFAULT_VOL
+    return np.where(np.isfinite(vols), vols, fallback)
+
+
+GREEK_NAMES = ('delta', 'gamma', 'theta', 'vega')
+
+
+def black76_greeks(forward, strike, years, vol, is_call, rate=RISK_FREE_RATE):
+    """每單位 (未乘契約乘數) 的 Greeks：theta 為每日，vega 為每 1% 波動率；到期時只剩 delta"""
+    forward, strike, years, vol = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (forward, strike, years, vol)))
+    is_call = np.broadcast_to(is_call, forward.shape)
+    d1, _, std = _d1_d2(forward, strike, years, vol)
+    live = std > 0
+    discount = np.exp(-rate * years)
+    pdf = norm_pdf(d1)
+
+    intrinsic_delta = np.where(is_call, (forward > strike).astype(float), -(forward < strike).astype(float))
+    delta = np.where(live, discount * np.where(is_call, norm_cdf(d1), norm_cdf(d1) - 1.0), intrinsic_delta)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = np.where(live, discount * pdf / (forward * std), 0.0)
+        decay = discount * forward * pdf * vol / (2 * np.sqrt(years))
+    price = black76_price(forward, strike, years, vol, is_call, rate)
+    theta = np.where(live, rate * price - decay, 0.0) / 365
+    vega = np.where(live, discount * forward * pdf * np.sqrt(years), 0.0) / 100
+
+    return {'delta': delta, 'gamma': gamma, 'theta': theta, 'vega': vega}
+
+
+class GreeksEngine:
+    """以合約為單位快取 Greeks 向量：剩餘年數、波動率與評價價格點都沒變的合約直接沿用，
+    其餘合約合成一批一次計算"""
+
+    def __init__(self, rate=RISK_FREE_RATE):
+        self.rate = rate
+        self.entries = {}   # 合約鍵 -> ((剩餘年數, 波動率, 價格點), {greek: 向量})
+
+    def is_fresh(self, key, years, vol, points):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        cached_years, cached_vol, cached_points = entry[0]
+        return cached_years == years and cached_vol == vol and \
+            (cached_points is points or np.array_equal(cached_points, points, equal_nan=True))
+
+    def evaluate(self, keys, strikes, is_call, years, vols, points):
+        """回傳 {greek: (合約數 x 價格點數)}，順序與 keys 相同"""
+        strikes = np.asarray(strikes, dtype=float)
+        is_call = np.asarray(is_call, dtype=bool)
+        years = np.asarray(years, dtype=float)
+        vols = np.asarray(vols, dtype=float)
+        points = np.asarray(points, dtype=float)
+
+        stale = [i for i, key in enumerate(keys) if not self.is_fresh(key, years[i], vols[i], points)]
+        if stale:
+            greeks = black76_greeks(points[None, :], strikes[stale][:, None], years[stale][:, None],
+                                    vols[stale][:, None], is_call[stale][:, None], self.rate)
+            for row, i in enumerate(stale):
+                self.entries[keys[i]] = ((years[i], vols[i], points),
+                                         {name: greeks[name][row] for name in GREEK_NAMES})
+
+        return {name: np.array([self.entries[key][1][name] for key in keys]).reshape(len(keys), len(points))
+                for name in GREEK_NAMES}
+
+
+def scenario_pnl(strikes, is_call, scale, cost, years, vols, spot, moves, vol_shifts, days, rate=RISK_FREE_RATE):
+    """投組在 (天數 x 波動率平移 x 標的變動) 格點上的總損益。
+    strikes/is_call/scale/years/vols 為每個合約一筆 (scale 已含方向、淨數量與乘數)，cost 為建倉總成本；
+    moves 為標的變動點數，vol_shifts 為波動率的絕對加減，days 為往後天數"""
+    strikes = np.asarray(strikes, dtype=float)
+    is_call = np.asarray(is_call, dtype=bool)
+    scale = np.asarray(scale, dtype=float)
+    prices = spot + np.asarray(moves, dtype=float)
+    shifted = np.maximum(np.asarray(vols, dtype=float)[None, :] + np.asarray(vol_shifts, dtype=float)[:, None], MIN_VOL)
+    remaining = np.maximum(np.asarray(years, dtype=float)[None, :] - np.asarray(days, dtype=float)[:, None] / 365, 0)
+
+    cube = np.empty((len(remaining), len(shifted), len(prices)))
+    # 逐天計算，記憶體只需 (波動率平移 x 合約 x 價格點)
+    for d, years_left in enumerate(remaining):
+        value = black76_price(prices[None, None, :], strikes[None, :, None], years_left[None, :, None],
+                              shifted[:, :, None], is_call[None, :, None], rate)
+        cube[d] = np.einsum('l,vlm->vm', scale, value) - cost
+    return cube
+
+
+def _scenario_chunk(args):
+    # 給 ProcessPoolExecutor 用的頂層函式
+    return scenario_pnl(*args)
+
+
+class ScenarioEngine:
+    """情境立方體的計算與快取：同一組部位與參數只算一次；格點夠大時依天數切塊交給多個行程"""
+
+    def __init__(self, max_workers=None, parallel_threshold=5_000_000, max_cached=8):
+        self.max_workers = max_workers
+        self.parallel_threshold = parallel_threshold   # 合約數 x 格點數超過此值才動用行程池
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def compute(self, key, strikes, is_call, scale, cost, years, vols, spot, moves, vol_shifts, days):
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        days = np.asarray(days, dtype=float)
+        size = len(strikes) * len(days) * len(vol_shifts) * len(moves)
+        if size > self.parallel_threshold and len(days) > 1:
+            chunks = np.array_split(days, min(len(days), self.max_workers or 4))
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                parts = executor.map(_scenario_chunk, [(strikes, is_call, scale, cost, years, vols, spot, moves, vol_shifts, chunk)
+                                                       for chunk in chunks if len(chunk)])
+                cube = np.concatenate(list(parts))
+        else:
+            cube = scenario_pnl(strikes, is_call, scale, cost, years, vols, spot, moves, vol_shifts, days)
+
+        with self.lock:
+            self.cache[key] = cube
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return cube
@@ -0,0 +1,188 @@
+import json
+import os
+from datetime import timedelta
+import numpy as np
+
+
+class OtmSeriesWriter:
+    """價外資料的 JSON Lines 寫入器，每筆紀錄只附加一行，不再讀取後整檔重寫"""
+
+    def __init__(self, fsync_every=1):
+        self.fsync_every = fsync_every  # 每寫入幾筆做一次 fsync
+        self.file_path = None
+        self.file = None
+        self.pending = 0
+
+    def open(self, file_path):
+        self.close()
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        self.file = open(file_path, "a+", encoding="utf-8")
+        self.file_path = file_path
+
+        # 上次寫到一半就中斷時，先補上換行，避免新紀錄接在殘缺的那行後面
+        if self.file.tell() > 0:
+            self.file.seek(self.file.tell() - 1)
+            if self.file.read(1) != "\n":
+                self.file.write("\n")
+
+    def append(self, file_path, timestamp, record):
+        if file_path != self.file_path:
+            self.open(file_path)
+
+        self.file.write(json.dumps({"timestamp": timestamp, **record}, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self.file and self.pending:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+        self.file = None
+        self.file_path = None
+
+
+def load_otm_series(file_path):
+    """讀取價外資料，回傳與舊版 {today}_otm.json 相同的 {時間: 紀錄} 格式"""
+    if not file_path.endswith(".jsonl"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    series = {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中斷時殘留的不完整紀錄
+            series[record.pop("timestamp")] = record
+
+    return series
+
+
+QUOTE_COLUMNS = {
+    "timestamp": "<i8",     # epoch 秒
+    "strike": "<f8",
+    "right": "i1",          # 0: put, 1: call
+    "bid": "<f8",
+    "ask": "<f8",
+    "mid": "<f8",
+}
+
+SUM_COLUMNS = {
+    "timestamp": "<i8",
+    "put_otm_sum": "<f8",
+    "call_otm_sum": "<f8",
+    "otm_sum": "<f8",
+}
+
+
+def _append_columns(table_folder, columns, values):
+    os.makedirs(table_folder, exist_ok=True)
+    for name, dtype in columns.items():
+        with open(os.path.join(table_folder, f"{name}.bin"), "ab") as f:
+            f.write(np.asarray(values[name], dtype=dtype).tobytes())
+
+
+def _open_columns(table_folder, columns):
+    """以 memmap 開啟各欄位，列數取各欄位的最小值（寫到一半中斷時多出的尾巴不算）"""
+    sizes = {}
+    for name, dtype in columns.items():
+        path = os.path.join(table_folder, f"{name}.bin")
+        sizes[name] = os.path.getsize(path) // np.dtype(dtype).itemsize if os.path.exists(path) else 0
+    rows = min(sizes.values())
+
+    if rows == 0:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in columns.items()}
+
+    return {
+        name: np.memmap(os.path.join(table_folder, f"{name}.bin"), dtype=dtype, mode="r", shape=(rows,))
+        for name, dtype in columns.items()
+    }
+
+
+class OtmColumnArchive:
+    """每日一個資料夾、每個欄位一個二進位檔的價外資料庫，查詢時以 memmap 只讀取需要的區段"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def day_folder(self, day):
+        return os.path.join(self.root, day.strftime("%Y-%m-%d"))
+
+    def append(self, timestamp, strikes, rights, bids, asks, put_otm_sum, call_otm_sum, otm_sum):
+        folder = self.day_folder(timestamp)
+        epoch = int(timestamp.timestamp())
+
+        bids = np.asarray(bids, dtype=float)
+        asks = np.asarray(asks, dtype=float)
+
+        _append_columns(os.path.join(folder, "quotes"), QUOTE_COLUMNS, {
+            "timestamp": np.full(len(bids), epoch),
+            "strike": strikes,
+            "right": rights,
+            "bid": bids,
+            "ask": asks,
+            "mid": (bids + asks) / 2,
+        })
+        _append_columns(os.path.join(folder, "sums"), SUM_COLUMNS, {
+            "timestamp": [epoch],
+            "put_otm_sum": [put_otm_sum],
+            "call_otm_sum": [call_otm_sum],
+            "otm_sum": [otm_sum],
+        })
+
+    def _days(self, start, end):
+        day = start.date()
+        while day <= end.date():
+            folder = self.day_folder(day)
+            if os.path.isdir(folder):
+                yield folder
+            day += timedelta(days=1)
+
+    def _iter_table(self, table, columns, start, end):
+        start_epoch = int(start.timestamp())
+        end_epoch = int(end.timestamp())
+
+        for folder in self._days(start, end):
+            data = _open_columns(os.path.join(folder, table), columns)
+
+            # 同一天內的紀錄依時間附加，時間欄已排序，可直接二分搜尋出區段
+            lower = np.searchsorted(data["timestamp"], start_epoch, side="left")
+            upper = np.searchsorted(data["timestamp"], end_epoch, side="right")
+            if lower < upper:
+                yield {name: column[lower:upper] for name, column in data.items()}
+
+    def iter_quotes(self, start, end, strike_min=None, strike_max=None):
+        """逐日回傳 [start, end] 區間的報價；未指定履約價範圍時為 memmap 的零複製切片"""
+        for data in self._iter_table("quotes", QUOTE_COLUMNS, start, end):
+            if strike_min is not None or strike_max is not None:
+                mask = np.ones(len(data["strike"]), dtype=bool)
+                if strike_min is not None:
+                    mask &= data["strike"] >= strike_min
+                if strike_max is not None:
+                    mask &= data["strike"] <= strike_max
+                data = {name: column[mask] for name, column in data.items()}
+            yield data
+
+    def query_quotes(self, start, end, strike_min=None, strike_max=None):
+        return _concat(self.iter_quotes(start, end, strike_min, strike_max), QUOTE_COLUMNS)
+
+    def query_sums(self, start, end):
+        return _concat(self._iter_table("sums", SUM_COLUMNS, start, end), SUM_COLUMNS)
+
+
+def _concat(chunks, columns):
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+    if not chunks:
+        return {name: np.empty(0, dtype=dtype) for name, dtype in columns.items()}
+    return {name: np.concatenate([chunk[name] for chunk in chunks]) for name in columns}
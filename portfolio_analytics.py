@@ -0,0 +1,514 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import numpy as np
+from option_pricing import black76_price
+
+CONTRACT_SIZE = 50  # 台指選擇權每點 50 元
+
+
+def pack_positions(positions):
+    """把部位 dict 清單轉成陣列，到期日依第一次出現的順序編號；cost 為含方向與乘數的建倉成本"""
+    expiries = list(dict.fromkeys(pos['expiration'] for pos in positions))
+    expiry_index = {expiry: i for i, expiry in enumerate(expiries)}
+    legs = {
+        'expiries': expiries,
+        'expiry_id': np.array([expiry_index[pos['expiration']] for pos in positions], dtype=int),
+        'strike': np.array([pos['strike'] for pos in positions], dtype=float),
+        'quantity': np.array([pos['quantity'] for pos in positions], dtype=float),
+        'premium': np.array([pos['price'] for pos in positions], dtype=float),
+        'sign': np.array([1.0 if pos['action'] == 'Buy' else -1.0 for pos in positions]),
+        'is_call': np.array([pos['type'] == 'Call' for pos in positions], dtype=bool),
+    }
+    legs['cost'] = legs['sign'] * legs['quantity'] * legs['premium'] * CONTRACT_SIZE
+    return legs
+
+
+def net_legs(legs):
+    """同一合約 (到期日, 履約價, 買賣權) 的部位合併成一條淨部位：
+    淨數量 = Σ 方向x數量，成本 = Σ 方向x數量x權利金，premium 為加權平均權利金。
+    買賣互抵後淨數量為 0 的合約只留下成本 (已實現損益)，平倉交易因此精確抵銷。
+    回傳 (淨部位, 每筆原始部位對應的淨部位編號)"""
+    keys = np.column_stack([legs['expiry_id'], legs['strike'], legs['is_call']])
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    count = len(first)
+
+    signed = np.bincount(inverse, weights=legs['sign'] * legs['quantity'], minlength=count)
+    cost = np.bincount(inverse, weights=legs['cost'], minlength=count)
+    netted = {
+        'expiries': legs['expiries'],
+        'expiry_id': legs['expiry_id'][first],
+        'strike': legs['strike'][first],
+        'is_call': legs['is_call'][first],
+        'sign': np.where(signed < 0, -1.0, 1.0),
+        'quantity': np.abs(signed),
+        'cost': cost,
+        'premium': np.divide(cost, signed * CONTRACT_SIZE, out=np.zeros(count), where=signed != 0),
+    }
+    return netted, inverse
+
+
+def leg_keys(legs):
+    """每條部位的 (到期日, 履約價, 'Call'/'Put')，與部位 dict 的欄位一致"""
+    return [(legs['expiries'][e], int(k), 'Call' if c else 'Put')
+            for e, k, c in zip(legs['expiry_id'], legs['strike'], legs['is_call'])]
+
+
+def net_breakdown(positions):
+    """淨部位明細：每個合約的淨數量 (買正賣負)、加權平均權利金，以及各來源 (原始/虛擬) 的淨數量"""
+    if not positions:
+        return []
+    legs = pack_positions(positions)
+    netted, inverse = net_legs(legs)
+    rows = [{'expiration': e, 'strike': k, 'type': t,
+             'net_quantity': float(netted['sign'][i] * netted['quantity'][i]),
+             'avg_price': float(netted['premium'][i]), 'cost': float(netted['cost'][i]), 'sources': {}}
+            for i, (e, k, t) in enumerate(leg_keys(netted))]
+    for pos, i, signed in zip(positions, inverse, legs['sign'] * legs['quantity']):
+        sources = rows[i]['sources']
+        sources[pos['source']] = sources.get(pos['source'], 0.0) + float(signed)
+    return rows
+
+
+def payoff_matrix(legs, price_range):
+    """到期損益矩陣 (部位數 x 價格點數)"""
+    strikes = legs['strike'][:, None]
+    intrinsic = np.where(legs['is_call'][:, None],
+                         np.maximum(price_range - strikes, 0),
+                         np.maximum(strikes - price_range, 0))
+    scale = legs['sign'] * legs['quantity'] * CONTRACT_SIZE
+    return scale[:, None] * intrinsic - legs['cost'][:, None]
+
+
+def adaptive_price_grid(kinks, lower, upper, budget=200, center=None, breakevens=(),
+                        dense_width=0.03, dense_share=0.6):
+    """到期損益是分段線性，格點只要包含所有轉折點 (履約價) 就能精確畫出；
+    再放入損益平衡點讓正負填色的邊界正確，剩下的點數大部分集中在目前價格 ±dense_width 內
+    (給 T+n 等平滑曲線用)，其餘平均撒在兩端的線性區"""
+    kinks = np.asarray(kinks, dtype=float)
+    breakevens = np.asarray(breakevens, dtype=float)
+    fixed = np.concatenate([[lower, upper], kinks, breakevens])
+    fixed = fixed[(fixed >= lower) & (fixed <= upper)]
+
+    remaining = max(budget - len(np.unique(fixed)), 0)
+    dense = np.empty(0)
+    if center is not None and lower < center < upper:
+        dense = np.linspace(max(lower, center * (1 - dense_width)), min(upper, center * (1 + dense_width)),
+                            int(remaining * dense_share))
+    sparse = np.linspace(lower, upper, max(remaining - len(dense), 2))
+    return np.unique(np.concatenate([fixed, dense, sparse]))
+
+
+def theoretical_pnl(legs, price_range, years, vols):
+    """Black-76 理論損益 (時間切片數 x 價格點數)；years 為 (時間切片數 x 部位數) 的剩餘年數。
+    傳入 net_legs 合併後的部位，合約 x 切片 x 價格點一次廣播計算"""
+    scale = legs['sign'] * legs['quantity'] * CONTRACT_SIZE
+    value = black76_price(price_range[None, None, :], legs['strike'][None, :, None],
+                          years[:, :, None], vols[None, :, None], legs['is_call'][None, :, None])
+    return np.einsum('l,slg->sg', scale, value) - legs['cost'].sum()
+
+
+def group_by_expiry(legs, matrix):
+    """依到期日加總損益矩陣 (到期日數 x 價格點數)"""
+    one_hot = legs['expiry_id'][None, :] == np.arange(len(legs['expiries']))[:, None]
+    return one_hot.astype(float) @ matrix
+
+
+def find_breakevens(x, y):
+    # 相鄰兩點異號處以線性內插求損益平衡點
+    i = np.nonzero(y[:-1] * y[1:] < 0)[0]
+    return list(x[i] - y[i] * (x[i + 1] - x[i]) / (y[i + 1] - y[i]))
+
+
+def summarize_curve(x, y):
+    """回傳 (最大獲利, 最大虧損, 損益平衡點)"""
+    if len(y) == 0:
+        return 0, 0, []
+
+    max_profit = np.max(y)
+    max_loss = np.min(y)
+
+    # 無限判斷(簡化)
+    if len(x) > 2:
+        if y[-1] > y[-2] + 1000:
+            max_profit = float('inf')
+        if y[0] < y[1] - 1000:
+            max_loss = float('-inf')
+
+    return max_profit, max_loss, find_breakevens(x, y)
+
+
+def select_legs(legs, mask):
+    selected = {name: values[mask] for name, values in legs.items() if name != 'expiries'}
+    selected['expiries'] = legs['expiries']
+    return selected
+
+
+def _runs(indices):
+    """已排序的索引切成連續區段，回傳 [(起, 迄)]"""
+    if not len(indices):
+        return []
+    breaks = np.nonzero(np.diff(indices) > 1)[0]
+    return list(zip(indices[np.r_[0, breaks + 1]], indices[np.r_[breaks, len(indices) - 1]]))
+
+
+def analyze_payoff_exact(legs):
+    """到期損益是只在履約價轉折的分段線性函數，由各轉折點的損益與右端斜率
+    直接求出精確的 (最大獲利, 最大虧損, 損益平衡點)，不受取樣點數影響"""
+    if len(legs['strike']) == 0:
+        return 0, 0, []
+
+    # 標的價格不會低於 0，左端以價格 0 的損益為準
+    kinks = np.unique(legs['strike'])
+    points = np.concatenate([[0.0], kinks])
+    y = payoff_matrix(legs, points).sum(axis=0)
+
+    # 最高履約價之後只剩 call 影響斜率
+    right_slope = (legs['sign'] * legs['quantity'] * CONTRACT_SIZE)[legs['is_call']].sum()
+
+    max_profit = float('inf') if right_slope > 0 else y.max()
+    max_loss = float('-inf') if right_slope < 0 else y.min()
+
+    # 兩轉折點之間異號：線段與 0 的交點
+    i = np.nonzero(y[:-1] * y[1:] < 0)[0]
+    breakevens = list(points[i] - y[i] * (points[i + 1] - points[i]) / (y[i + 1] - y[i]))
+
+    # 連續一段轉折點上都為 0 (或只有一點)，且這段前後異號：損益在這段持平於 0，
+    # 兩端都列為損益平衡點 (只有一點時即為該點)；最右端之後以延伸線的斜率當作下一點的符號
+    signs = np.append(np.sign(y), np.sign(right_slope))
+    zeros = np.nonzero(y == 0)[0]
+    for start, stop in _runs(zeros):
+        if start > 0 and signs[start - 1] * signs[stop + 1] < 0:
+            breakevens.extend({points[start], points[stop]})
+
+    # 右端延伸線與 0 的交點
+    if right_slope != 0 and y[-1] * right_slope < 0:
+        breakevens.append(kinks[-1] - y[-1] / right_slope)
+
+    return max_profit, max_loss, sorted(breakevens)
+
+
+class PortfolioCurve:
+    """依到期日快取的投組損益曲線：新增/刪除部位時只加減該部位的損益向量，
+    統計值也只重算有變動的到期日"""
+
+    def __init__(self, positions, points=200, exact=True, center=None, dense_width=0.03):
+        self.points = points            # 格點點數預算，履約價與損益平衡點一定在格點內
+        self.exact = exact
+        self.center = center            # 目前價格，附近的格點較密
+        self.dense_width = dense_width
+        self.rebuild(positions)
+
+    def rebuild(self, positions):
+        self.positions = list(positions)
+        self.expiry_y = {}
+        self.stats_cache = {}
+        self.legs = None
+        self.strikes = set()
+
+        if not self.positions:
+            self.x = None
+            self.total_y = None
+            return
+
+        # 同一合約的多筆成交先合併，評價的部位數只剩不同合約數
+        legs, _ = net_legs(pack_positions(self.positions))
+        self.min_strike = legs['strike'].min()
+        self.max_strike = legs['strike'].max()
+        self.strikes = set(legs['strike'].tolist())
+
+        breakevens = []
+        if self.exact:
+            # 精確統計在建格點前先算好，順便把損益平衡點放進格點
+            self.stats_cache['Total'] = analyze_payoff_exact(legs)
+            breakevens.extend(self.stats_cache['Total'][2])
+            for i, expiry in enumerate(legs['expiries']):
+                self.stats_cache[expiry] = analyze_payoff_exact(select_legs(legs, legs['expiry_id'] == i))
+                breakevens.extend(self.stats_cache[expiry][2])
+
+        self.x = adaptive_price_grid(legs['strike'], self.min_strike * 0.99, self.max_strike * 1.01,
+                                     budget=self.points, center=self.center, breakevens=breakevens,
+                                     dense_width=self.dense_width)
+
+        expiry_y = group_by_expiry(legs, payoff_matrix(legs, self.x))
+        for i, expiry in enumerate(legs['expiries']):
+            self.expiry_y[expiry] = expiry_y[i]
+        self.total_y = expiry_y.sum(axis=0)
+        self.legs = legs
+
+    def add(self, pos):
+        # 超出目前價格範圍或是新的履約價 (格點缺少這個轉折點) 時重建格點
+        if self.x is None or pos['strike'] not in self.strikes:
+            self.rebuild(self.positions + [pos])
+            return
+
+        y = payoff_matrix(pack_positions([pos]), self.x)[0]
+        expiry = pos['expiration']
+        # 產生新陣列而非就地加總，已交給圖表的曲線不會被改到
+        self.expiry_y[expiry] = self.expiry_y[expiry] + y if expiry in self.expiry_y else y
+        self.total_y = self.total_y + y
+        self.positions.append(pos)
+        self.invalidate(expiry)
+        self.insert_breakevens(expiry)
+
+    def remove(self, pos):
+        index = next(i for i, p in enumerate(self.positions) if p is pos)
+        remaining = self.positions[:index] + self.positions[index + 1:]
+
+        # 移除最高/最低履約價時 X 軸會縮小，重建以與全量計算一致
+        if not remaining or pos['strike'] in (self.min_strike, self.max_strike):
+            self.rebuild(remaining)
+            return
+
+        y = payoff_matrix(pack_positions([pos]), self.x)[0]
+        expiry = pos['expiration']
+        self.positions = remaining
+        if any(p['expiration'] == expiry for p in remaining):
+            self.expiry_y[expiry] = self.expiry_y[expiry] - y
+        else:
+            del self.expiry_y[expiry]
+        self.total_y = self.total_y - y
+        self.invalidate(expiry)
+        self.insert_breakevens(expiry)
+
+    def insert_breakevens(self, expiry):
+        """精確模式下增減部位後，把新的損益平衡點補進格點，曲線與統計值才會在同一點過零"""
+        if not self.exact:
+            return
+        breakevens = list(self.stats()[2])
+        if expiry in self.expiry_y:
+            breakevens.extend(self.stats(expiry)[2])
+
+        missing = np.setdiff1d(np.asarray(breakevens, dtype=float), self.x)
+        missing = missing[(missing > self.x[0]) & (missing < self.x[-1])]
+        if not len(missing):
+            return
+
+        # 到期損益在相鄰履約價之間是線性的，而履約價都在格點上，線性內插即為精確值
+        x = np.union1d(self.x, missing)
+        self.expiry_y = {e: np.interp(x, self.x, y) for e, y in self.expiry_y.items()}
+        self.total_y = np.interp(x, self.x, self.total_y)
+        self.x = x
+
+    def recenter(self, center):
+        """目前價格移出密集區一半寬度以上才重建，回傳是否重建"""
+        if center is None or (self.center is not None and
+                              abs(center - self.center) <= self.center * self.dense_width / 2):
+            return False
+        self.center = center
+        self.rebuild(self.positions)
+        return True
+
+    def invalidate(self, expiry):
+        self.legs = None
+        self.stats_cache.pop(expiry, None)
+        self.stats_cache.pop('Total', None)
+
+    def stats(self, expiry='Total'):
+        """(最大獲利, 最大虧損, 損益平衡點)，未變動的到期日直接取快取"""
+        if expiry not in self.stats_cache:
+            if expiry == 'Total':
+                y = self.total_y
+            else:
+                y = self.expiry_y.get(expiry)
+
+            if y is None:
+                self.stats_cache[expiry] = (0, 0, [])
+            elif self.exact:
+                if self.legs is None:
+                    self.legs, _ = net_legs(pack_positions(self.positions))
+                legs = self.legs
+                if expiry != 'Total':
+                    legs = select_legs(legs, legs['expiry_id'] == legs['expiries'].index(expiry))
+                self.stats_cache[expiry] = analyze_payoff_exact(legs)
+            else:
+                self.stats_cache[expiry] = summarize_curve(self.x, y)
+
+        return self.stats_cache[expiry]
+
+
+class PositionBook:
+    """即時部位簿：啟動時以 list_positions 的結果建立一次，之後依成交回報逐筆更新。
+    每個合約只有一筆淨部位 dict，變動時以新的 dict 取代舊的 (不就地修改)，
+    並通知訂閱者 {'added': [...], 'removed': [...]}，可直接交給 PortfolioCurve.add/remove"""
+
+    def __init__(self):
+        self.legs = {}          # (到期日, 履約價, 類型) -> 部位 dict
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def seed(self, positions):
+        """以完整部位清單重設部位簿，不發出差異；回傳部位簿中的部位"""
+        with self.lock:
+            self.legs = {}
+            for pos in positions:
+                key = (pos['expiration'], pos['strike'], pos['type'])
+                old = self.legs.get(key)
+                self.legs[key] = pos if old is None else _merge_fill(old, pos['action'], pos['quantity'], pos['price'])
+            return list(self.legs.values())
+
+    def positions(self):
+        with self.lock:
+            return list(self.legs.values())
+
+    def apply_fill(self, expiration, strike, opt_type, action, quantity, price, source='原始'):
+        """套用一筆成交並通知訂閱者，回傳差異"""
+        key = (expiration, int(strike), opt_type)
+        with self.lock:
+            old = self.legs.get(key)
+            if old is None:
+                new = {'expiration': expiration, 'strike': int(strike), 'type': opt_type, 'action': action,
+                       'quantity': quantity, 'price': price, 'source': source}
+            else:
+                new = _merge_fill(old, action, quantity, price)
+
+            if new is None:
+                del self.legs[key]
+            else:
+                self.legs[key] = new
+
+        diff = {'added': [new] if new else [], 'removed': [old] if old else []}
+        for callback in self.listeners:
+            callback(diff)
+        return diff
+
+
+def _merge_fill(pos, action, quantity, price):
+    # 同方向以加權平均價加碼；反方向先沖銷，超過的部分以成交價翻成新方向，剛好沖完回傳 None
+    if pos['action'] == action:
+        total = pos['quantity'] + quantity
+        average = (pos['price'] * pos['quantity'] + price * quantity) / total
+        return dict(pos, quantity=total, price=average)
+    remaining = pos['quantity'] - quantity
+    if remaining > 0:
+        return dict(pos, quantity=remaining)
+    if remaining < 0:
+        return dict(pos, action=action, quantity=-remaining, price=price)
+    return None
+
+
+def portfolio_report(positions, points=200, exact=True, include_curves=True, center=None):
+    """單一投組的到期損益曲線與統計 (總計及各到期日)，不依賴 Qt，可直接在無介面的環境使用"""
+    portfolio = PortfolioCurve(positions, points=points, exact=exact, center=center)
+    report = {'positions': len(portfolio.positions), 'stats': {}}
+    if portfolio.x is None:
+        return report
+
+    for expiry in list(portfolio.expiry_y) + ['Total']:
+        max_profit, max_loss, breakevens = portfolio.stats(expiry)
+        report['stats'][expiry] = {
+            'max_profit': _json_number(max_profit),
+            'max_loss': _json_number(max_loss),
+            'breakevens': [float(bp) for bp in breakevens],
+        }
+
+    report['net_positions'] = net_breakdown(portfolio.positions)
+
+    if include_curves:
+        report['x'] = portfolio.x.tolist()
+        report['curves'] = {expiry: y.tolist() for expiry, y in portfolio.expiry_y.items()}
+        report['curves']['Total'] = portfolio.total_y.tolist()
+    return report
+
+
+def _json_number(value):
+    # JSON 沒有無限大，以字串表示
+    if np.isinf(value):
+        return "inf" if value > 0 else "-inf"
+    return float(value)
+
+
+OPTION_TYPES = {'call': 'Call', 'c': 'Call', 'put': 'Put', 'p': 'Put'}
+ACTIONS = {'buy': 'Buy', 'b': 'Buy', 'sell': 'Sell', 's': 'Sell'}
+
+
+def _normalize(value, names, field):
+    # 後續只比對 'Call' / 'Buy'，大小寫不同或拼錯會被當成 Put / Sell，這裡直接拒絕
+    normalized = names.get(str(value).strip().lower())
+    if normalized is None:
+        raise ValueError(f"無法辨識的 {field}: {value!r}")
+    return normalized
+
+
+def load_positions(path):
+    """讀取部位檔：CSV (欄位 expiration,strike,type,action,quantity,price[,source])
+    或 JSON (部位 dict 的清單，或 {"positions": [...]})。
+    type 接受 Call/Put/C/P、action 接受 Buy/Sell/B/S (不分大小寫)，其他值丟出 ValueError"""
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        rows = data['positions'] if isinstance(data, dict) else data
+    else:
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    return [{
+        'expiration': str(row['expiration']),
+        'strike': int(float(row['strike'])),
+        'type': _normalize(row['type'], OPTION_TYPES, 'type'),
+        'action': _normalize(row['action'], ACTIONS, 'action'),
+        'quantity': int(float(row['quantity'])),
+        'price': float(row['price']),
+        'source': row.get('source') or '原始',
+    } for row in rows]
+
+
+def report_names(paths):
+    """每個部位檔的輸出名稱：相對於所有檔案共同目錄的路徑 (不含副檔名)，
+    不同帳戶資料夾下的同名檔案因此不會互相覆蓋"""
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths])
+    return [os.path.splitext(os.path.relpath(os.path.abspath(path), root))[0].replace(os.sep, '/')
+            for path in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次計算投組到期損益曲線與統計")
+    parser.add_argument("files", nargs="+", help="部位檔 (CSV 或 JSON)")
+    parser.add_argument("--out", help="輸出目錄，每個部位檔寫一個 JSON；未指定時全部輸出到標準輸出")
+    parser.add_argument("--points", type=int, default=200, help="曲線格點點數預算")
+    parser.add_argument("--spot", type=float, help="目前價格，附近的格點較密")
+    parser.add_argument("--sampled", action="store_true", help="統計值改用取樣曲線估計")
+    parser.add_argument("--no-curves", action="store_true", help="只輸出統計值")
+    args = parser.parse_args()
+
+    reports = {}
+    failed = []
+    sources = {}    # 名稱 -> 部位檔
+    for path, name in zip(args.files, report_names(args.files)):
+        if name in sources:
+            # 例如同一資料夾下的 pos.csv 與 pos.json，輸出會互相覆蓋
+            print(f"部位檔 {path} 與 {sources[name]} 的輸出名稱同為 {name}", file=sys.stderr)
+            failed.append(path)
+            continue
+        sources[name] = path
+        try:
+            reports[name] = portfolio_report(load_positions(path), points=args.points, exact=not args.sampled,
+                                             include_curves=not args.no_curves, center=args.spot)
+        except (OSError, KeyError, ValueError) as e:
+            # 錯誤訊息寫到 stderr，不混進標準輸出的 JSON
+            print(f"讀取部位檔 {path} 失敗: {e}", file=sys.stderr)
+            failed.append(path)
+            continue
+
+        if args.out:
+            out_path = os.path.join(args.out, f"{name}.json")
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'w', encoding='utf-8') as f:
+                json.dump(reports[name], f, ensure_ascii=False)
+
+    if not args.out:
+        print(json.dumps(reports, ensure_ascii=False, indent=2))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import deque
+
+SNAPSHOT_BATCH_LIMIT = 500  # 永豐 snapshots 單次請求的合約數上限
+
+
+def fetch_snapshots(api, contracts, batch_size=SNAPSHOT_BATCH_LIMIT, rate_limiter=None):
+    """以最少次數的 snapshots 請求取得多個合約的快照，回傳 {合約代碼: 快照}"""
+    contracts = [contract for contract in contracts if contract is not None]
+    snapshots = {}
+
+    for start in range(0, len(contracts), batch_size):
+        batch = contracts[start:start + batch_size]
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            for snapshot in api.snapshots(batch):
+                snapshots[snapshot.code] = snapshot
+        except Exception as e:
+            codes = ", ".join(contract.code for contract in batch)
+            print(f"批次取得快照時出錯 ({codes}): {e}")
+
+    return snapshots
+
+
+class RateLimiter:
+    """滑動視窗限流，預設為永豐快照 5 秒 50 次的上限，可跨執行緒共用"""
+
+    def __init__(self, max_calls=50, period=5.0):
+        self.max_calls = max_calls
+        self.period = period
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= self.period:
+                    self.calls.popleft()
+
+                if len(self.calls) < self.max_calls:
+                    self.calls.append(now)
+                    return
+
+                wait = self.period - (now - self.calls[0])
+            time.sleep(wait)
+
+
+class QuoteCache:
+    """以合約代碼為鍵的快照快取，超過 ttl 秒視為過期需重新取得"""
+
+    def __init__(self, api, ttl=5.0, rate_limiter=None):
+        self.api = api
+        self.ttl = ttl
+        self.rate_limiter = rate_limiter
+        self.entries = {}   # 合約代碼 -> (取得時間, 快照)
+        self.lock = threading.Lock()
+
+    def fresh(self, code):
+        with self.lock:
+            entry = self.entries.get(code)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def store(self, snapshots):
+        now = time.monotonic()
+        with self.lock:
+            for code, snapshot in snapshots.items():
+                self.entries[code] = (now, snapshot)
+
+    def prefetch(self, contracts):
+        """只對沒有快取或已過期的合約發出批次請求"""
+        missing = [contract for contract in contracts if contract is not None and self.fresh(contract.code) is None]
+        if missing:
+            self.store(fetch_snapshots(self.api, missing, rate_limiter=self.rate_limiter))
+
+    def get(self, contract):
+        snapshot = self.fresh(contract.code)
+        if snapshot is None:
+            self.prefetch([contract])
+            with self.lock:
+                entry = self.entries.get(contract.code)
+            snapshot = entry[1] if entry else None
+        return snapshot